@@ -0,0 +1,211 @@
+import json
+import time
+import random
+import logging
+import emoji
+import config
+import mapping_store
+
+# ------------------------
+# Direction-agnostic bridge pipeline
+# ------------------------
+# Both directions run the same steps on a BridgeMessage:
+#   normalize (platform adapter) -> route -> format -> media -> deliver (adapter)
+#   -> record the ID mapping
+# The platform modules only turn their native messages into BridgeMessages
+# (normalize) and implement the adapter methods:
+#   kind(message, replying)                 -> mapping/log kind
+#   deliver(message, header, reply_to)      -> target message IDs (raises on failure)
+#   edit(message, target_id, reply_to)
+#   delete(route, target_ids)               (Discord -> Telegram only)
+# Reply lookups, the "same author is still talking" header logic, mapping
+# writes and logging live here, once for both directions.
+
+PLATFORMS = ('telegram', 'discord')
+LOG_ID_FIELDS = {'telegram': 'tg_msg_id', 'discord': 'dc_msg_id'}
+# The header is skipped while the same author keeps talking; streaks expire after this long
+LAST_USER_TTL = 5 * 60
+# With no bridged message on the other side yet, a repeat within this many seconds still counts
+STREAK_GRACE = 1
+
+# Emojized once instead of on every message
+AVATAR_EMOJIS = tuple(emoji.emojize(name) for name in config.AVATAR_EMOJIS)
+
+# platform -> {channel id: (user id, monotonic time)}
+_last_users = {'telegram': config.TELEGRAM_CHANNEL_LAST_USER, 'discord': config.DISCORD_CHANNEL_LAST_USER}
+
+class BridgeMessage:
+    __slots__ = (
+        'source', 'route', 'message_id', 'source_ids', 'author_id', 'author_name',
+        'text', 'reply_to_id', 'media', 'raw', 'parts',
+    )
+
+    def __init__(self, source, route, message_id, author_id, author_name, text,
+                 reply_to_id=None, media=None, raw=None, parts=None, source_ids=None):
+        self.source = source                  # 'telegram' or 'discord'
+        self.route = route                    # routes.Route
+        self.message_id = message_id
+        self.source_ids = source_ids or (message_id,)  # every source message this one stands for (album, burst)
+        self.author_id = str(author_id)
+        self.author_name = author_name
+        self.text = text                      # body in the source platform's markup
+        self.reply_to_id = reply_to_id        # source message ID replied to
+        self.media = media                    # adapter-specific: file paths or attachments
+        self.raw = raw                        # the native message
+        self.parts = parts or (raw,)          # native messages merged into this one
+
+    @property
+    def target(self):
+        return other_platform(self.source)
+
+def other_platform(platform):
+    return 'discord' if platform == 'telegram' else 'telegram'
+
+def channel_id(route, platform):
+    return route.telegram_channel_id if platform == 'telegram' else route.discord_channel_id
+
+def bot_id(platform):
+    return str(config.TELEGRAM_BOT_ID if platform == 'telegram' else config.DISCORD_BOT_ID)
+
+def avatar_emoji():
+    return random.choice(AVATAR_EMOJIS)
+
+# ------------------------
+# Logging
+# ------------------------
+
+def log_event(level, event, **fields):
+    # Pretty-printed JSON is costly, so it's only built when it will be written
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    payload = {"event": event, **fields}
+    message = json.dumps(payload, indent=2, ensure_ascii=False, default=str)
+    logging.log(level, message)
+
+def log_sent(source, source_id, target_id, route, kind):
+    target = other_platform(source)
+    log_event(
+        logging.INFO,
+        f"sent_{target}",
+        channel_id=channel_id(route, target),
+        **{LOG_ID_FIELDS[source]: source_id, LOG_ID_FIELDS[target]: target_id},
+        collection=route.collection_name,
+        kind=kind,
+    )
+
+# ------------------------
+# Last user per channel
+# ------------------------
+
+def set_last_user(platform, channel, user_id):
+    _last_users[platform][str(channel)] = (str(user_id), time.monotonic())
+
+def _get_last_user(platform, channel, now):
+    entry = _last_users[platform].get(str(channel))
+    if entry is None or now - entry[1] > LAST_USER_TTL:
+        return None
+    return entry
+
+def is_on_streak(message):
+    """
+    True when the author wrote the last message in the source channel and
+    nobody else has written on the other side since (the last message there
+    is our bridged one), so the name header can be skipped.
+    """
+    now = time.monotonic()
+    source_last = _get_last_user(message.source, channel_id(message.route, message.source), now)
+    if source_last is None or source_last[0] != message.author_id:
+        return False
+    target_last = _get_last_user(message.target, channel_id(message.route, message.target), now)
+    if target_last is not None:
+        return target_last[0] == bot_id(message.target)
+    return now - source_last[1] < STREAK_GRACE
+
+# ------------------------
+# Mapping
+# ------------------------
+
+async def get_counterpart_id(source, message_id, collection_name):
+    # ID of the bridged copy of a source message on the other platform
+    if source == 'telegram':
+        return await mapping_store.get_discord_message_id(telegram_message_id=message_id, collection_name=collection_name)
+    return await mapping_store.get_telegram_message_id(discord_message_id=message_id, collection_name=collection_name)
+
+async def get_copy_ids(source, message_id, collection_name):
+    # Every bridged copy of an original message (a Discord message with several
+    # attachments has one per item). A message that is itself a bridged copy
+    # has none, so it can't be mistaken for the original.
+    if source == 'telegram':
+        target_id = await mapping_store.get_discord_message_id(telegram_message_id=message_id, collection_name=collection_name)
+        return [target_id] if target_id else []
+    return await mapping_store.get_telegram_message_ids(discord_message_id=message_id, collection_name=collection_name, source=source)
+
+async def save_mapping(source, source_id, target_id, collection_name, kind):
+    if source == 'telegram':
+        await mapping_store.save_message(telegram_message_id=source_id, discord_message_id=target_id, collection_name=collection_name, kind=kind, source=source)
+    else:
+        await mapping_store.save_message(discord_message_id=source_id, telegram_message_id=target_id, collection_name=collection_name, kind=kind, source=source)
+
+# ------------------------
+# Pipeline
+# ------------------------
+
+async def relay(message, adapter):
+    """
+    Sends a normalized message to the other platform through adapter and
+    records the mapping from every source ID to every delivered message.
+    Returns the delivered message IDs (empty on failure).
+    """
+    route = message.route
+    reply_to = None
+    if message.reply_to_id:
+        # Replies to messages that were never bridged go out as plain messages
+        reply_to = await get_counterpart_id(message.source, message.reply_to_id, route.collection_name)
+
+    header = not is_on_streak(message)
+    set_last_user(message.source, channel_id(route, message.source), message.author_id)
+    kind = adapter.kind(message, reply_to is not None)
+    try:
+        target_ids = await adapter.deliver(message, header, reply_to)
+    except Exception:
+        logging.error("Error sending %s message %s to %s", message.source, message.message_id, message.target, exc_info=True)
+        return []
+    finally:
+        set_last_user(message.target, channel_id(route, message.target), bot_id(message.target))
+
+    for target_id in target_ids:
+        for source_id in message.source_ids:
+            await save_mapping(message.source, source_id, target_id, route.collection_name, kind)
+        log_sent(message.source, message.message_id, target_id, route, kind)
+    return target_ids
+
+async def relay_edit(message, adapter):
+    # message: the edited message, normalized (a whole burst if it went out merged)
+    route = message.route
+    target_id = await get_counterpart_id(message.source, message.message_id, route.collection_name)
+    if not target_id:
+        logging.debug("Edited %s message %s was never bridged", message.source, message.message_id)
+        return
+    reply_to = None
+    if message.reply_to_id:
+        reply_to = await get_counterpart_id(message.source, message.reply_to_id, route.collection_name)
+    try:
+        await adapter.edit(message, target_id, reply_to)
+    except Exception:
+        logging.error("Error editing %s message %s on %s", message.source, message.message_id, message.target, exc_info=True)
+        return
+    log_sent(message.source, message.message_id, target_id, route, "edit")
+
+async def relay_delete(source, message_id, route, adapter):
+    # Only deletes of original messages are bridged: deleting a bridged copy
+    # (e.g. a moderator removing it on Discord) must not delete the original
+    target_ids = await get_copy_ids(source, message_id, route.collection_name)
+    if not target_ids:
+        return
+    try:
+        await adapter.delete(route, target_ids)
+    except Exception:
+        logging.error("Error deleting %s message %s on %s", source, message_id, other_platform(source), exc_info=True)
+        return
+    for target_id in target_ids:
+        log_sent(source, message_id, target_id, route, "delete")
@@ -9,6 +9,7 @@ load_dotenv(dotenv_path=env_path)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 
+# Channel ID -> (user ID, monotonic time) of the last message there; kept by bridge
 TELEGRAM_CHANNEL_LAST_USER = {}
 DISCORD_CHANNEL_LAST_USER = {}
 
@@ -30,6 +31,106 @@ AVATAR_EMOJIS = [
     ":mosquito:", ":fly:", ":worm:", ":microbe:", ":turtle:", ":snake:", ":lizard:", ":crocodile:"
 ]
 
+# Mapping storage backend: "mongo" (default), "sqlite" (embedded, WAL) or "memory" (non-persistent)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("data", "mappings.sqlite3"))
+
+# Retention of message-ID mappings in days (0 keeps them forever). Mongo enforces it
+# with a TTL index on created_at; SQLite and memory purge every MAPPING_PURGE_INTERVAL seconds.
+# With MAPPING_ARCHIVE_DIR set, expired rows are first written there as gzip JSONL and the
+# Mongo TTL is pushed back by MAPPING_ARCHIVE_GRACE_HOURS so archiving runs first.
+MAPPING_RETENTION_DAYS = float(os.getenv("MAPPING_RETENTION_DAYS", "0"))
+MAPPING_PURGE_INTERVAL = int(os.getenv("MAPPING_PURGE_INTERVAL", "3600"))
+MAPPING_ARCHIVE_DIR = os.getenv("MAPPING_ARCHIVE_DIR")
+MAPPING_ARCHIVE_GRACE_HOURS = float(os.getenv("MAPPING_ARCHIVE_GRACE_HOURS", "24"))
+
+# Mongo mapping layout: "consolidated" (one MAPPINGS_COLLECTION for all routes) or
+# "per_chat" (legacy collection per db_collection). Keep MAPPING_LEGACY_FALLBACK on
+# until migrate_mappings.py has copied the per-chat collections.
+MONGO_SCHEMA = os.getenv("MONGO_SCHEMA", "consolidated")
+MAPPINGS_COLLECTION = os.getenv("MAPPINGS_COLLECTION", "message_mappings")
+MAPPING_LEGACY_FALLBACK = os.getenv("MAPPING_LEGACY_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# Max worker threads (and Mongo connections) used for mapping-store calls off the event loop
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+# Write-behind batching of message-ID mappings: flush when a collection buffer
+# reaches MAPPING_FLUSH_SIZE rows or every MAPPING_FLUSH_INTERVAL seconds
+MAPPING_FLUSH_SIZE = int(os.getenv("MAPPING_FLUSH_SIZE", "100"))
+MAPPING_FLUSH_INTERVAL = float(os.getenv("MAPPING_FLUSH_INTERVAL", "1.0"))
+
+# Number of recent telegram<->discord ID pairs kept in memory per collection (0 disables)
+MAPPING_CACHE_SIZE = int(os.getenv("MAPPING_CACHE_SIZE", "2048"))
+
+# Telegram update ingest: "polling" (default) or "webhook". In webhook mode a local
+# HTTP server on TELEGRAM_WEBHOOK_HOST:PORT receives updates posted to TELEGRAM_WEBHOOK_URL
+# (the public URL, usually behind a reverse proxy) and checks TELEGRAM_WEBHOOK_SECRET
+# (a random secret is generated on each start when it is unset).
+# If the webhook can't be set up the bot falls back to polling.
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+TELEGRAM_WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+
+# Outbound Telegram rate limits: per-chat token bucket (Telegram allows ~20 messages/min
+# in groups) with a small burst, and a bot-wide bucket (~30 messages/s)
+TELEGRAM_CHAT_RATE_PER_MIN = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MIN", "20"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "5"))
+TELEGRAM_GLOBAL_RATE_PER_SEC = float(os.getenv("TELEGRAM_GLOBAL_RATE_PER_SEC", "30"))
+
+# Seconds to wait for more items of a Telegram album before sending it to Discord as one message
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.0"))
+
+# Seconds a text message is held on routes with "coalesce": true, so a burst of
+# messages from the same author can be merged into one
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0.4"))
+
+# Seconds an edited message waits for further edits before the edit is bridged
+EDIT_DEBOUNCE = float(os.getenv("EDIT_DEBOUNCE", "1.5"))
+
+# Content-addressed media cache: converted Telegram downloads (reused when the same
+# file_unique_id comes again) plus Telegram file_ids by content hash.
+# MEDIA_CACHE_MAX_MB bounds the files on disk (0 disables caching files), LRU evicted.
+# The index is saved at most every MEDIA_CACHE_SAVE_INTERVAL seconds while it changes.
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join("data", "media_cache"))
+MEDIA_CACHE_MAX_BYTES = int(float(os.getenv("MEDIA_CACHE_MAX_MB", "512")) * 1024 * 1024)
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "10000"))
+MEDIA_CACHE_SAVE_INTERVAL = float(os.getenv("MEDIA_CACHE_SAVE_INTERVAL", "60"))
+
+# Video transcoding pool: concurrent ffmpeg processes, jobs allowed to wait for one
+# (further videos are sent as is) and per-job timeouts in seconds
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+TRANSCODE_MAX_QUEUE = int(os.getenv("TRANSCODE_MAX_QUEUE", "16"))
+TRANSCODE_TIMEOUT = float(os.getenv("TRANSCODE_TIMEOUT", "300"))
+TRANSCODE_PROBE_TIMEOUT = float(os.getenv("TRANSCODE_PROBE_TIMEOUT", "15"))
+
+# Animated (.tgs) and video (.webm) sticker conversion for Discord: output format
+# ("gif" or "webp"), max side in px, concurrent conversions, and per-conversion
+# CPU seconds / wall-clock seconds. .tgs stickers are rendered with rlottie-python.
+STICKER_FORMAT = os.getenv("STICKER_FORMAT", "gif")
+STICKER_SIZE = int(os.getenv("STICKER_SIZE", "256"))
+STICKER_WORKERS = int(os.getenv("STICKER_WORKERS", "1"))
+STICKER_CPU_SECONDS = int(os.getenv("STICKER_CPU_SECONDS", "20"))
+STICKER_TIMEOUT = float(os.getenv("STICKER_TIMEOUT", "60"))
+
+# Let Telegram fetch Discord attachments from their CDN URL when no conversion is
+# needed (falls back to download-and-upload if Telegram rejects the URL)
+ATTACHMENT_URL_PASSTHROUGH = os.getenv("ATTACHMENT_URL_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+
+# Discord->Telegram image pipeline: worker processes for HEIC conversion and
+# downscaling, and the longest side (px) photos are scaled down to
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2560"))
+
+# How Telegram messages are posted to Discord: "bot" posts them as the bot
+# account under an emoji + name header, "webhook" through a pool of
+# DISCORD_WEBHOOKS_PER_CHANNEL webhooks per channel with the Telegram user's
+# name (needs Manage Webhooks; channels without it fall back to the bot)
+DISCORD_DELIVERY = os.getenv("DISCORD_DELIVERY", "bot").lower()
+DISCORD_WEBHOOKS_PER_CHANNEL = int(os.getenv("DISCORD_WEBHOOKS_PER_CHANNEL", "2"))
+
 FFMPEG_PATH = os.getenv("FFMPEG_PATH")
 WELCOME_MESSAGE = "Привіт! Я пересилаю повідомлення між Discord сервером Kyiv Hackerspace Community та Telegram.\nДоєднуйся до Kyiv Hackerspace Community: https://discord.com/invite/sgCQBWpAm8"
 
@@ -1,8 +1,14 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 import logging
 import os
+import datetime
+import threading
+import config
+import routes
 
 load_dotenv()
 
@@ -13,9 +19,12 @@ MONGO_URI = os.environ.get('MONGO_URI') or os.environ.get('MONGO_DB')
 if not MONGO_URI:
     raise ValueError("Missing MongoDB connection string. Set MONGO_URI in .env (or MONGO_DB for legacy).")
 
-mongo_client = MongoClient(MONGO_URI, server_api=ServerApi('1'), serverSelectionTimeoutMS=60000)
+mongo_client = MongoClient(MONGO_URI, server_api=ServerApi('1'), serverSelectionTimeoutMS=60000, maxPoolSize=config.DB_POOL_SIZE)
 db = mongo_client['telegram-discord-bot']
 
+_known_collections = set()
+_collections_lock = threading.Lock()
+
 def ping_mongo():
     try:
         mongo_client.admin.command('ping')
@@ -23,24 +32,40 @@ def ping_mongo():
         logging.error("Error connecting to MongoDB", exc_info=True)
         raise
 
-def save_message_to_db(telegram_message_id, discord_message_id, collection_name):
-    # Check if collection exists, if not create it
-    if collection_name not in db.list_collection_names():
-        create_collection(collection_name)
+def save_message_to_db(telegram_message_id, discord_message_id, collection_name, kind=None, source=None):
+    ensure_collection(collection_name)
 
     messages_collection = db[collection_name]
     try:
         messages_collection.insert_one({
             "telegram_message_id": telegram_message_id,
-            "discord_message_id": discord_message_id
+            "discord_message_id": discord_message_id,
+            "kind": kind,
+            "source": source,
+            "created_at": datetime.datetime.now(datetime.timezone.utc)
         })
     except Exception as e:
         logging.error("Error saving message to database", exc_info=True)
     
+def save_messages_to_db(mappings, collection_name):
+    # Bulk variant used by the write-behind buffer; mappings is a list of
+    # (telegram_message_id, discord_message_id, kind, source) tuples
+    if not mappings:
+        return
+    ensure_collection(collection_name)
+
+    messages_collection = db[collection_name]
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        messages_collection.insert_many([
+            {"telegram_message_id": telegram_message_id, "discord_message_id": discord_message_id, "kind": kind, "source": source, "created_at": created_at}
+            for telegram_message_id, discord_message_id, kind, source in mappings
+        ], ordered=False)
+    except Exception:
+        logging.error("Error saving %s messages to database", len(mappings), exc_info=True)
+
 def get_discord_message_id(telegram_message_id, collection_name):
-    # Check if collection exists, if not create it
-    if collection_name not in db.list_collection_names():
-        create_collection(collection_name)
+    ensure_collection(collection_name)
 
     messages_collection = db[collection_name]
     result = messages_collection.find_one({"telegram_message_id": telegram_message_id})
@@ -48,17 +73,207 @@ def get_discord_message_id(telegram_message_id, collection_name):
         return result['discord_message_id']
     return None
 
-def get_telegram_message_id(discord_message_id, collection_name):
-    # Check if collection exists, if not create it
-    if collection_name not in db.list_collection_names():
-        create_collection(collection_name)
+def get_telegram_message_id(discord_message_id, collection_name, source=None):
+    # With source, only rows recorded from that platform match
+    ensure_collection(collection_name)
 
     messages_collection = db[collection_name]
-    result = messages_collection.find_one({"discord_message_id": discord_message_id})
+    query = {"discord_message_id": discord_message_id}
+    if source is not None:
+        query["source"] = source
+    # Oldest row first, like find_telegram_message_id(), so both schemas agree on
+    # which Telegram message a multi-row Discord message resolves to
+    result = messages_collection.find_one(query, sort=[("_id", ASCENDING)])
     if result:
         return result['telegram_message_id']
     return None
+
+def get_telegram_message_ids(discord_message_id, collection_name, source=None):
+    # Every Telegram message bridged from one Discord message, in insertion order
+    ensure_collection(collection_name)
+
+    messages_collection = db[collection_name]
+    query = {"discord_message_id": discord_message_id}
+    if source is not None:
+        query["source"] = source
+    return [row['telegram_message_id'] for row in messages_collection.find(query, {"telegram_message_id": 1}, sort=[("_id", ASCENDING)])]
+
+def ensure_collection(collection_name):
+    # Collections already checked in this process are tracked in memory, so the
+    # list_collection_names() round trip only happens once per collection
+    if collection_name in _known_collections:
+        return
+    with _collections_lock:
+        if collection_name in _known_collections:
+            return
+        if not _known_collections:
+            _known_collections.update(db.list_collection_names())
+        if collection_name not in _known_collections:
+            create_collection(collection_name)
+        ensure_indexes(collection_name)
+        _known_collections.add(collection_name)
+
+def drop_index_if_exists(collection, index_name):
+    if index_name in collection.index_information():
+        collection.drop_index(index_name)
+        logging.info("Dropped index %s on %s", index_name, collection.name)
+
+def ensure_indexes(collection_name):
+    # Each (telegram_message_id, discord_message_id) pair is stored once. Neither
+    # side is unique on its own: one Discord message with several attachments maps
+    # to several Telegram messages, and a coalesced burst of Discord messages maps
+    # to one Telegram message. The pair index also serves Telegram-side lookups.
+    messages_collection = db[collection_name]
+    try:
+        messages_collection.create_index([("telegram_message_id", ASCENDING), ("discord_message_id", ASCENDING)], unique=True, name="telegram_message_id_1_discord_message_id_1")
+    except OperationFailure:
+        logging.warning("Duplicate mapping rows in %s, creating non-unique index", collection_name, exc_info=True)
+        messages_collection.create_index([("telegram_message_id", ASCENDING), ("discord_message_id", ASCENDING)], name="telegram_message_id_1_discord_message_id_1")
+    # Replaced by the pair index; the old unique one would reject burst rows
+    drop_index_if_exists(messages_collection, "telegram_message_id_1")
+    messages_collection.create_index([("discord_message_id", ASCENDING)], name="discord_message_id_1")
+    ensure_ttl_index(collection_name)
+
+def ensure_ttl_index(collection_name):
+    # Rows expire through a TTL index on created_at. When archiving is enabled the
+    # TTL only acts as a safety net behind the archiving purge in storage.py.
+    # Rows written before created_at existed have no timestamp and never expire.
+    if config.MAPPING_RETENTION_DAYS <= 0:
+        return
+    expire_after = int(config.MAPPING_RETENTION_DAYS * 86400)
+    if config.MAPPING_ARCHIVE_DIR:
+        expire_after += int(config.MAPPING_ARCHIVE_GRACE_HOURS * 3600)
+
+    messages_collection = db[collection_name]
+    try:
+        messages_collection.create_index([("created_at", ASCENDING)], name="created_at_1", expireAfterSeconds=expire_after)
+    except OperationFailure:
+        # Index exists with a different expiry: update it in place
+        db.command("collMod", collection_name, index={"name": "created_at_1", "expireAfterSeconds": expire_after})
+
+def find_expired(collection_name, cutoff):
+    # Rows created before cutoff, for archiving ahead of deletion
+    ensure_collection(collection_name)
+
+    messages_collection = db[collection_name]
+    return messages_collection.find(
+        {"created_at": {"$lt": cutoff}},
+        {"_id": 0, "telegram_message_id": 1, "discord_message_id": 1, "source": 1, "created_at": 1}
+    )
+
+def delete_expired(collection_name, cutoff):
+    ensure_collection(collection_name)
+
+    messages_collection = db[collection_name]
+    return messages_collection.delete_many({"created_at": {"$lt": cutoff}}).deleted_count
+
+def ensure_collections(collection_names):
+    # Called once at startup for every collection referenced by channels.json
+    for collection_name in collection_names:
+        try:
+            ensure_collection(collection_name)
+        except Exception:
+            logging.error("Error preparing collection %s", collection_name, exc_info=True)
 
+# ------------------------
+# Consolidated mapping collection
+# ------------------------
+# One collection for every route, keyed by the route name (db_collection in
+# channels.json) and carrying the chat/channel IDs, message kind, source
+# platform and creation time. Used when MONGO_SCHEMA is "consolidated"; migrate_mappings.py copies
+# the per-chat collections into it.
+
+MAPPINGS_COLLECTION = config.MAPPINGS_COLLECTION
+_mappings_ready = False
+
+def ensure_mappings_collection():
+    global _mappings_ready
+    if _mappings_ready:
+        return
+    with _collections_lock:
+        if _mappings_ready:
+            return
+        mappings_collection = db[MAPPINGS_COLLECTION]
+        # Unique per (route, telegram, discord) pair, see ensure_indexes()
+        mappings_collection.create_index(
+            [("route", ASCENDING), ("telegram_message_id", ASCENDING), ("discord_message_id", ASCENDING)],
+            unique=True, name="route_1_telegram_message_id_1_discord_message_id_1"
+        )
+        drop_index_if_exists(mappings_collection, "route_1_telegram_message_id_1")
+        mappings_collection.create_index([("route", ASCENDING), ("discord_message_id", ASCENDING)], name="route_1_discord_message_id_1")
+        ensure_ttl_index(MAPPINGS_COLLECTION)
+        _mappings_ready = True
+
+def build_mapping_document(route_name, telegram_message_id, discord_message_id, kind=None, created_at=None, source=None):
+    route = routes.get_route_by_collection(route_name)
+    return {
+        "route": route_name,
+        "telegram_chat_id": int(route.telegram_channel_id) if route else None,
+        "discord_channel_id": int(route.discord_channel_id) if route else None,
+        "telegram_message_id": telegram_message_id,
+        "discord_message_id": discord_message_id,
+        "kind": kind,
+        "source": source,
+        "created_at": created_at or datetime.datetime.now(datetime.timezone.utc),
+    }
+
+def save_mappings(mappings, route_name):
+    if not mappings:
+        return
+    ensure_mappings_collection()
+
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        db[MAPPINGS_COLLECTION].insert_many([
+            build_mapping_document(route_name, telegram_message_id, discord_message_id, kind, created_at, source)
+            for telegram_message_id, discord_message_id, kind, source in mappings
+        ], ordered=False)
+    except Exception:
+        logging.error("Error saving %s mappings to database", len(mappings), exc_info=True)
+
+def find_discord_message_id(telegram_message_id, route_name):
+    ensure_mappings_collection()
+
+    result = db[MAPPINGS_COLLECTION].find_one({"route": route_name, "telegram_message_id": telegram_message_id})
+    if result:
+        return result['discord_message_id']
+    return None
+
+def find_telegram_message_id(discord_message_id, route_name, source=None):
+    ensure_mappings_collection()
+
+    query = {"route": route_name, "discord_message_id": discord_message_id}
+    if source is not None:
+        query["source"] = source
+    result = db[MAPPINGS_COLLECTION].find_one(
+        query,
+        sort=[("_id", ASCENDING)]
+    )
+    if result:
+        return result['telegram_message_id']
+    return None
+
+def find_telegram_message_ids(discord_message_id, route_name, source=None):
+    ensure_mappings_collection()
+
+    query = {"route": route_name, "discord_message_id": discord_message_id}
+    if source is not None:
+        query["source"] = source
+    return [row['telegram_message_id'] for row in db[MAPPINGS_COLLECTION].find(query, {"telegram_message_id": 1}, sort=[("_id", ASCENDING)])]
+
+def find_expired_mappings(route_name, cutoff):
+    ensure_mappings_collection()
+
+    return db[MAPPINGS_COLLECTION].find(
+        {"route": route_name, "created_at": {"$lt": cutoff}},
+        {"_id": 0}
+    )
+
+def delete_expired_mappings(route_name, cutoff):
+    ensure_mappings_collection()
+
+    return db[MAPPINGS_COLLECTION].delete_many({"route": route_name, "created_at": {"$lt": cutoff}}).deleted_count
+
 def create_collection(collection_name):
     try:
         db.create_collection(collection_name)
@@ -1,23 +1,19 @@
-import threading
-import time
-import discord
-from discord import Intents, Client, Message, MessageType
-from discord.ext import commands
-import os
-import db
+from discord import Intents, Client
+import routes
+import telegram_sender
+import media_cache
+import image_pipeline
+import discord_webhooks
+import message_bursts
+import message_edits
+import bridge
 import asyncio
-import emoji
-import random
 import config
 import json
-import datetime
 import logging
 from io import BytesIO
 import telebot
 # from telebot.types import InputFile
-from PIL import Image
-import pillow_heif
-import io
 from hackbridge_formatter import hackbridge_header_handler
 
 intents = Intents.default()
@@ -26,15 +22,10 @@ discord_client = Client(intents=intents)
 
 discord_loop = asyncio.get_event_loop()
 
-def log_event(level, event, **fields):
-    payload = {"event": event, **fields}
-    message = json.dumps(payload, indent=2, ensure_ascii=False, default=str)
-    logging.log(level, message)
-
 def log_incoming(message):
     if message.author == discord_client.user:
         return
-    log_event(
+    bridge.log_event(
         logging.INFO,
         "incoming_discord",
         channel_id=message.channel.id,
@@ -44,16 +35,55 @@ def log_incoming(message):
         attachments=len(message.attachments),
     )
 
-def log_sent_to_telegram(discord_message_id, telegram_message_id, telegram_channel_id, collection_name, kind):
-    log_event(
-        logging.INFO,
-        "sent_telegram",
-        channel_id=telegram_channel_id,
-        dc_msg_id=discord_message_id,
-        tg_msg_id=telegram_message_id,
-        collection=collection_name,
-        kind=kind,
-    )
+# Telegram's sendMediaGroup accepts 2-10 items
+MEDIA_GROUP_LIMIT = 10
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# What Telegram will fetch from a URL itself: photos up to 5 MB, other files up
+# to 20 MB, and for sendDocument only GIF, PDF and ZIP files
+URL_PHOTO_TYPES = ('image/jpeg', 'image/png')
+URL_PHOTO_MAX_BYTES = 5 * 1024 * 1024
+URL_FILE_MAX_BYTES = 20 * 1024 * 1024
+URL_VIDEO_TYPES = ('video/mp4',)
+URL_DOCUMENT_EXTENSIONS = ('.gif', '.pdf', '.zip')
+
+# ------------------------
+# Bridged channel cache
+# ------------------------
+# Telegram->Discord sends look channels up here instead of calling fetch_channel
+# (a REST round trip) per message. The gateway cache (get_channel) is tried
+# first; channels it doesn't hold (e.g. archived threads) are fetched once and
+# kept until a delete/remove event or a reconnect invalidates them.
+
+_channels = {}
+# Discord message ID -> (on_message task, telegram_sender.Delivery) still sending it to Telegram
+_sending = {}
+# Messages deleted on Discord after part of them already reached Telegram
+_deleted_while_sending = set()
+# Message ID -> latest edit made while the message was still sending
+_edited_while_sending = {}
+
+async def get_discord_channel(channel_id):
+    channel_id = int(channel_id)
+    channel = discord_client.get_channel(channel_id) or _channels.get(channel_id)
+    if channel is None:
+        channel = await discord_client.fetch_channel(channel_id)
+    _channels[channel_id] = channel
+    return channel
+
+def forget_channel(channel_id):
+    _channels.pop(int(channel_id), None)
+    discord_webhooks.forget_channel(int(channel_id))
+
+async def warm_channel_cache():
+    # Resolve every bridged channel up front; runs on each (re)connect
+    _channels.clear()
+    for route in routes.all_routes():
+        try:
+            await get_discord_channel(route.discord_channel_id)
+        except Exception as e:
+            logging.warning("Failed to resolve Discord channel %s: %s", route.discord_channel_id, e)
+    logging.info("Resolved %s bridged Discord channels", len(_channels))
 
 # ------------------------
 # Event handlers for Discord bot
@@ -63,236 +93,466 @@ def log_sent_to_telegram(discord_message_id, telegram_message_id, telegram_chann
 async def on_ready():
     config.DISCORD_BOT_ID = discord_client.user.id
     logging.info("Discord bot connected as %s (id=%s)", discord_client.user, config.DISCORD_BOT_ID)
+    await warm_channel_cache()
+    await discord_webhooks.setup(list(_channels.values()), discord_client.user, discord_client.application_id)
+
+@discord_client.event
+async def on_guild_channel_delete(channel):
+    forget_channel(channel.id)
+
+@discord_client.event
+async def on_thread_delete(thread):
+    forget_channel(thread.id)
+
+@discord_client.event
+async def on_guild_remove(guild):
+    for channel_id, channel in list(_channels.items()):
+        if getattr(channel, 'guild', None) == guild:
+            forget_channel(channel_id)
 
 @discord_client.event
 async def on_message(message):
-    user_data = get_discord_user_data(message)
-
     if message.author == discord_client.user:
-        update_last_message_user_id()
-        set_last_message_user_id(user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
+        bridge.set_last_user('discord', message.channel.id, message.author.id)
+
+        return json.dumps({"status":"ignored"})
+
+    if await discord_webhooks.is_bridge_message(message):
+        # Posted by our own delivery webhook: it came from Telegram, don't echo it back
+        bridge.set_last_user('discord', message.channel.id, config.DISCORD_BOT_ID)
 
         return json.dumps({"status":"ignored"})
 
     log_incoming(message)
 
-    # Load the channels mapping from the JSON file
-    try:
-        channels_mapping = load_channels_mapping()
-    except Exception as e:
-        logging.error("Error loading channels mapping", exc_info=True)
-        return
-    
-    # Get the Telegram channel ID based on the Discord channel ID
-    telegram_channel = channels_mapping.get(str(message.channel.id))
-    if not telegram_channel:
+    # Resolve the route for this Discord channel from the in-memory index
+    route = routes.get_route_by_discord(message.channel.id)
+    if not route:
         logging.warning("Telegram channel ID not found for Discord channel ID: %s", message.channel.id)
         return
 
-    # Get the collection name based on the Telegram channel ID
-    collection_name = get_collection_name(telegram_channel)
-    if not collection_name:
-        logging.warning("Collection name not found for channel ID: %s", telegram_channel)
+    if not route.collection_name:
+        logging.warning("Collection name not found for channel ID: %s", route.telegram_channel_id)
         return
 
-    # Send the message to Telegram
-    if message.reference and message.reference.message_id:        
-        update_last_message_user_id()
-        await send_to_telegram_reply(message, telegram_channel, collection_name)
-        set_last_message_user_id(user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
-        set_telegram_last_user_id(user_id=str(config.TELEGRAM_BOT_ID), channel_id=str(telegram_channel))
-    else:        
-        update_last_message_user_id()
-        await send_to_telegram(message, telegram_channel, collection_name)
-        set_last_message_user_id(user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
-        set_telegram_last_user_id(user_id=str(config.TELEGRAM_BOT_ID), channel_id=str(telegram_channel))
+    burst_key = ('discord', message.channel.id)
+    if route.coalesce and can_coalesce(message):
+        # Held briefly so following lines from the same user go out as one Telegram message
+        message_bursts.add(
+            burst_key, message.author.id, message.id, message, len(format_mentions(message)),
+            TELEGRAM_MESSAGE_LIMIT - len(message.author.display_name) - 16,  # room for the emoji + name header
+            lambda messages: relay_to_telegram(messages, route),
+        )
+        return
+    await message_bursts.flush(burst_key)
+
+    # Send the message to Telegram; tracked so deleting it on the way withdraws
+    # the send, or removes the Telegram copy once it's there
+    _sending[message.id] = (asyncio.current_task(), telegram_sender.track_delivery())
+    try:
+        await relay_to_telegram([message], route)
+    finally:
+        _sending.pop(message.id, None)
+        edited = _edited_while_sending.pop(message.id, None)
+    if message.id in _deleted_while_sending:
+        _deleted_while_sending.discard(message.id)
+        await bridge.relay_delete('discord', message.id, route, TELEGRAM)
+    elif edited is not None:
+        # The mapping is stored now, so the edit has something to apply to
+        schedule_edit(edited, route)
+
+@discord_client.event
+async def on_raw_message_edit(payload):
+    # Raw event: also covers messages that dropped out of (or never were in) the message cache
+    message = payload.message
+    if message.author == discord_client.user or await discord_webhooks.is_bridge_message(message):
+        return
+    if message.edited_at is None:
+        # Embed/link preview updates, not an edit by the author
+        return
+    route = routes.get_route_by_discord(message.channel.id)
+    if not route or not route.collection_name:
+        return
+
+    if message.id in _sending:
+        # No mapping to edit yet: on_message replays the latest edit once it's stored
+        _edited_while_sending[message.id] = message
+        return
+    if message_bursts.replace(('discord', message.channel.id), message.id, message):
+        # Not sent yet: the burst goes out with the new text
+        return
+    schedule_edit(message, route)
+
+def schedule_edit(message, route):
+    burst_key = ('discord', message.channel.id)
+    message_bursts.update_delivered(burst_key, message.id, message)
+
+    async def on_edit(edited):
+        # A line of a burst re-renders the whole merged message from its lines as
+        # they are now, so lines deleted while the edit waited stay out
+        messages = message_bursts.get_delivered(burst_key, message.id) or edited
+        await bridge.relay_edit(normalize(messages, route), TELEGRAM)
+
+    message_edits.schedule(('discord', message.id), [message], on_edit)
+
+@discord_client.event
+async def on_raw_message_delete(payload):
+    # Bridged copies are skipped here when cached, and by relay_delete's
+    # source check otherwise
+    cached = payload.cached_message
+    if cached is not None and (cached.author == discord_client.user or await discord_webhooks.is_bridge_message(cached)):
+        return
+    route = routes.get_route_by_discord(payload.channel_id)
+    if not route or not route.collection_name:
+        return
+
+    message_edits.cancel(('discord', payload.message_id))
+    burst_key = ('discord', payload.channel_id)
+    if message_bursts.discard(burst_key, payload.message_id):
+        logging.debug("Deleted Discord message %s dropped before sending", payload.message_id)
+        return
+    sending = _sending.get(payload.message_id)
+    if sending is not None:
+        task, delivery = sending
+        if telegram_sender.withdraw(delivery):
+            # Nothing of it has reached Telegram yet
+            logging.debug("Deleted Discord message %s withdrawn before sending", payload.message_id)
+            task.cancel()
+        else:
+            # Cancelling now could leave part of it on Telegram with no mapping:
+            # on_message deletes it once the send is done
+            logging.debug("Deleted Discord message %s will be removed once sent", payload.message_id)
+            _deleted_while_sending.add(payload.message_id)
+        return
+
+    remaining = message_bursts.remove_delivered(burst_key, payload.message_id)
+    if remaining:
+        # Other lines of the merged message are still there: re-render it without this one
+        await bridge.relay_edit(normalize(remaining, route), TELEGRAM)
+    else:
+        await bridge.relay_delete('discord', payload.message_id, route, TELEGRAM)
+
+def can_coalesce(message):
+    # Plain text from a person: no reply, attachments, stickers or bot formatting (HackBridge)
+    return (
+        bool(message.content)
+        and not message.author.bot
+        and not (message.reference and message.reference.message_id)
+        and not message.attachments
+        and not message.stickers
+    )
 
 # ------------------------
-# Functions to send messages to Telegram
+# Discord -> Telegram adapter
 # ------------------------
 
-async def send_to_telegram_reply(message: Message, telegram_channel, collection_name):
-    from telegram_bot import tg_bot
-
-    user_data = get_discord_user_data(message)
-    text, disable_preview = get_text_and_options(message, user_data, telegram_channel)
-    reply_to_message_id = message.reference.message_id
-    original_telegram_message_id = db.get_telegram_message_id(
-        discord_message_id=reply_to_message_id,
-        collection_name=collection_name
+def normalize(messages, route):
+    """
+    Builds the BridgeMessage for one Discord message, or for a burst of text
+    messages sent as one: the first one's author and reply, the texts joined,
+    every message ID mapped.
+    """
+    first_message = messages[0]
+    reference = first_message.reference
+    return bridge.BridgeMessage(
+        'discord', route, first_message.id,
+        author_id=first_message.author.id,
+        author_name=first_message.author.display_name,
+        text='\n'.join(format_mentions(message) for message in messages),
+        reply_to_id=reference.message_id if reference and reference.message_id else None,
+        media=first_message.attachments or None,
+        raw=first_message,
+        parts=messages,
+        source_ids=tuple(message.id for message in messages),
     )
 
-    if not original_telegram_message_id:
-        await send_to_telegram(message, telegram_channel, collection_name)
-        return
+async def relay_to_telegram(messages, route):
+    await bridge.relay(normalize(messages, route), TELEGRAM)
 
-    try:
-        if message.attachments:
-            for attachment in message.attachments:
-                tg_message = await process_attachment(attachment, text, telegram_channel, reply_to=original_telegram_message_id)
-                if tg_message:
-                    db.save_message_to_db(
-                        discord_message_id=user_data['message_id'],
-                        telegram_message_id=tg_message.message_id,
-                        collection_name=collection_name
-                    )
-                    log_sent_to_telegram(
-                        discord_message_id=user_data['message_id'],
-                        telegram_message_id=tg_message.message_id,
-                        telegram_channel_id=telegram_channel,
-                        collection_name=collection_name,
-                        kind="reply_attachment",
-                    )
-                    time.sleep(1)
-                else:
-                    logging.warning("Failed to send attachment %s, sending fallback text", attachment.filename)
-                    fallback_text = f'{text}\n<code>Failed to send attachment: {attachment.filename}</code>'
-                    fallback_message = tg_bot.send_message(
-                        chat_id=telegram_channel,
-                        text=fallback_text,
-                        parse_mode='html',
-                        disable_web_page_preview=disable_preview,
-                        reply_to_message_id=original_telegram_message_id
-                    )
-                    log_sent_to_telegram(
-                        discord_message_id=user_data['message_id'],
-                        telegram_message_id=fallback_message.message_id,
-                        telegram_channel_id=telegram_channel,
-                        collection_name=collection_name,
-                        kind="reply_fallback",
-                    )
-        else:
-            tg_message = tg_bot.send_message(
-                chat_id=telegram_channel,
+class TelegramAdapter:
+    __slots__ = ()
+
+    def kind(self, message, replying):
+        kind = "attachment" if message.media else "text"
+        return f"reply_{kind}" if replying else kind
+
+    def format(self, message, header):
+        # Returns (HTML text, disable_preview)
+        if len(message.parts) == 1:
+            # HackBridge header handler: rewrite formatted headers from the HackBridge bot and drop link previews
+            hackbridge_payload = hackbridge_header_handler(message.raw, render_header=config.HACKBRIDGE_RENDER_HEADER)
+            if hackbridge_payload:
+                return hackbridge_payload["text"], hackbridge_payload["disable_preview"]
+        if not header:
+            return message.text, False
+        return f"{bridge.avatar_emoji()} <b>{message.author_name}</b>\n{message.text}", False
+
+    async def deliver(self, message, header, reply_to):
+        from telegram_bot import tg_bot
+
+        text, disable_preview = self.format(message, header)
+        telegram_channel = message.route.telegram_channel_id
+        if not message.media:
+            tg_message = await telegram_sender.send(tg_bot.send_message,
+                chat_id=int(telegram_channel),
                 text=text,
                 parse_mode='html',
                 disable_web_page_preview=disable_preview,
-                reply_to_message_id=original_telegram_message_id
+                reply_to_message_id=reply_to
             )
-            db.save_message_to_db(
-                discord_message_id=user_data['message_id'],
-                telegram_message_id=tg_message.message_id,
-                collection_name=collection_name
+            return [tg_message.message_id]
+
+        tg_messages, failed_attachments = await send_attachments(message.media, text, telegram_channel, reply_to=reply_to)
+        for attachment in failed_attachments:
+            logging.warning("Failed to send attachment %s, sending fallback text", attachment.filename)
+            fallback_text = f'{text}\n<code>Failed to send attachment: {attachment.filename}</code>'
+            fallback_message = await telegram_sender.send(tg_bot.send_message,
+                chat_id=int(telegram_channel),
+                text=fallback_text,
+                parse_mode='html',
+                disable_web_page_preview=disable_preview,
+                reply_to_message_id=reply_to
             )
-            log_sent_to_telegram(
-                discord_message_id=user_data['message_id'],
-                telegram_message_id=tg_message.message_id,
-                telegram_channel_id=telegram_channel,
-                collection_name=collection_name,
-                kind="reply_text",
+            bridge.log_sent('discord', message.message_id, fallback_message.message_id, message.route, "reply_fallback" if reply_to else "fallback")
+        return [tg_message.message_id for tg_message in tg_messages]
+
+    async def edit(self, message, target_id, reply_to):
+        from telegram_bot import tg_bot
+
+        # The edit stands on its own, so it always carries the header
+        text, disable_preview = self.format(message, header=True)
+        if message.media:
+            await telegram_sender.send(tg_bot.edit_message_caption,
+                chat_id=int(message.route.telegram_channel_id),
+                message_id=target_id,
+                caption=text,
+                parse_mode='html'
             )
-    except Exception as e:
-        logging.error("Error sending reply message to Telegram", exc_info=True)
-
-async def send_to_telegram(message, telegram_channel, collection_name):
-    from telegram_bot import tg_bot
-
-    user_data = get_discord_user_data(message)
-    text, disable_preview = get_text_and_options(message, user_data, telegram_channel)
-
-    if message.attachments:
-        for attachment in message.attachments:
-            tg_message = await process_attachment(attachment, text, telegram_channel)
-            if tg_message:
-                db.save_message_to_db(
-                    discord_message_id=user_data['message_id'],
-                    telegram_message_id=tg_message.message_id,
-                    collection_name=collection_name
-                )
-                log_sent_to_telegram(
-                    discord_message_id=user_data['message_id'],
-                    telegram_message_id=tg_message.message_id,
-                    telegram_channel_id=telegram_channel,
-                    collection_name=collection_name,
-                    kind="attachment",
-                )
-                time.sleep(1)
-            else:
-                logging.warning("Failed to send attachment %s, sending fallback text", attachment.filename)
-                fallback_text = f'{text}\n<code>Failed to send attachment: {attachment.filename}</code>'
-                fallback_message = tg_bot.send_message(
-                    chat_id=int(telegram_channel),
-                    text=fallback_text,
-                    parse_mode='html',
-                    disable_web_page_preview=disable_preview
-                )
-                log_sent_to_telegram(
-                    discord_message_id=user_data['message_id'],
-                    telegram_message_id=fallback_message.message_id,
-                    telegram_channel_id=telegram_channel,
-                    collection_name=collection_name,
-                    kind="fallback",
-                )
-    else:
-        tg_message = tg_bot.send_message(
-            chat_id=int(telegram_channel),
-            text=text,
-            parse_mode='html',
-            disable_web_page_preview=disable_preview
-        )
-        db.save_message_to_db(
-            discord_message_id=user_data['message_id'],
-            telegram_message_id=tg_message.message_id,
-            collection_name=collection_name
-        )
-        log_sent_to_telegram(
-            discord_message_id=user_data['message_id'],
-            telegram_message_id=tg_message.message_id,
-            telegram_channel_id=telegram_channel,
-            collection_name=collection_name,
-            kind="text",
-        )
+        else:
+            await telegram_sender.send(tg_bot.edit_message_text,
+                chat_id=int(message.route.telegram_channel_id),
+                message_id=target_id,
+                text=text,
+                parse_mode='html',
+                disable_web_page_preview=disable_preview
+            )
+
+    async def delete(self, route, target_ids):
+        from telegram_bot import tg_bot
+
+        # All items of an album in one call
+        await telegram_sender.send(tg_bot.delete_messages, chat_id=int(route.telegram_channel_id), message_ids=list(target_ids))
+
+TELEGRAM = TelegramAdapter()
+
 # ------------------------
 # Helper functions
 # ------------------------
 
-def set_telegram_last_user_id(user_id:str, channel_id:str):
-    # Set the last message user ID for the current channel
-    config.TELEGRAM_CHANNEL_LAST_USER[channel_id] = {'user_id': user_id, 'timestamp': datetime.datetime.now(datetime.timezone.utc)}
-
-
-async def process_attachment(attachment, text, telegram_channel, reply_to=None):
-    from telegram_bot import tg_bot
-
-    file_bytes = await attachment.read()
+def get_attachment_kind(content_type):
+    if content_type.startswith("image/"):
+        return 'photo'
+    elif content_type.startswith("video/"):
+        return 'video'
+    else:
+        return 'document'
+
+def can_pass_url(attachment, kind):
+    # True when Telegram can fetch the attachment from Discord's CDN as is
+    content_type = (attachment.content_type or '').split(';')[0]
+    if image_pipeline.is_heic(attachment.filename):
+        return False
+    if kind == 'photo':
+        width, height = attachment.width, attachment.height
+        return (
+            content_type in URL_PHOTO_TYPES
+            and attachment.size <= URL_PHOTO_MAX_BYTES
+            and bool(width and height)
+            and max(width, height) <= config.IMAGE_MAX_SIDE
+            and width + height <= image_pipeline.TELEGRAM_PHOTO_MAX_DIMENSIONS
+        )
+    if kind == 'video':
+        return content_type in URL_VIDEO_TYPES and attachment.size <= URL_FILE_MAX_BYTES
+    return attachment.filename.lower().endswith(URL_DOCUMENT_EXTENSIONS) and attachment.size <= URL_FILE_MAX_BYTES
+
+async def prepare_attachment(attachment, allow_url=True):
+    """
+    Prepares a Discord attachment for Telegram and returns (kind, file, content_hash),
+    or None on failure. file is, cheapest first:
+      - attachment.url when Telegram can fetch it itself (content_hash is None)
+      - a Telegram file_id when the same content was sent before
+      - an InputFile with the downloaded (and, if needed, converted) bytes
+    """
     file_name = attachment.filename
-    content_type = attachment.content_type or ''
+    kind = get_attachment_kind(attachment.content_type or '')
+    if allow_url and config.ATTACHMENT_URL_PASSTHROUGH and can_pass_url(attachment, kind):
+        return kind, attachment.url, None
+
+    file_bytes = await attachment.read()
+    content_hash = media_cache.content_hash(file_bytes)
+
+    cached_file_id = media_cache.get_telegram_file_id(content_hash, kind)
+    if cached_file_id:
+        logging.debug("Reusing Telegram file_id for %s", file_name)
+        return kind, cached_file_id, content_hash
 
+    # HEIC is converted and oversized photos downscaled in the image process pool
+    if kind == 'photo' or image_pipeline.is_heic(file_name):
+        try:
+            file_bytes = await image_pipeline.prepare_photo(file_bytes, file_name)
+        except Exception:
+            logging.error("Error preparing file %s", file_name, exc_info=True)
+            return None
+
     try:
         tg_file = telebot.types.InputFile(BytesIO(file_bytes))
-    except Exception as e:
+    except Exception:
         logging.error("Error creating InputFile for %s", file_name, exc_info=True)
         return None
 
+    return kind, tg_file, content_hash
+
+async def send_prepared_attachment(kind, tg_file, file_name, text, telegram_channel, reply_to=None):
+    from telegram_bot import tg_bot
+
     try:
-        if file_name.lower().endswith(".heic"):
-            tg_file = await convert_heic_to_jpeg(file_bytes)
-    except Exception as e:
-        logging.error("Error preparing file %s", file_name, exc_info=True)
-        return None
-
-    try:
-        if content_type.startswith("image/"):
-            return tg_bot.send_photo(chat_id=int(telegram_channel), photo=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
-        elif content_type.startswith("video/"):
-            return tg_bot.send_video(chat_id=int(telegram_channel), video=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
+        if kind == 'photo':
+            return await telegram_sender.send(tg_bot.send_photo, chat_id=int(telegram_channel), photo=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
+        elif kind == 'video':
+            return await telegram_sender.send(tg_bot.send_video, chat_id=int(telegram_channel), video=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
         else:
-            return tg_bot.send_document(chat_id=int(telegram_channel), document=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
-    except Exception as e:
+            return await telegram_sender.send(tg_bot.send_document, chat_id=int(telegram_channel), document=tg_file, caption=text, parse_mode='html', reply_to_message_id=reply_to)
+    except Exception:
         logging.error("Error sending file %s", file_name, exc_info=True)
         return None
-
-def get_text(message, user_data, telegram_channel):
-    text = format_mentions(message)
-    
-    if not check_last_message_user_id(
-        current_user_id=str(user_data['user_id']),
-        telegram_channel_id=str(telegram_channel),
-        discord_channel_id=str(user_data['channel_id'])
-    ):
-        avatar_emoji = emoji.emojize(random.choice(config.AVATAR_EMOJIS))
-        return f"{avatar_emoji} <b>{user_data['user_name']}</b>\n{text}"
-    return text
+
+async def send_attachment(attachment, prepared, text, telegram_channel, reply_to=None):
+    kind, tg_file, content_hash = prepared
+    tg_message = await send_prepared_attachment(kind, tg_file, attachment.filename, text, telegram_channel, reply_to=reply_to)
+    if tg_message is None and tg_file == attachment.url:
+        # Telegram couldn't fetch the URL: download and upload instead
+        logging.info("Telegram rejected URL for %s, uploading it instead", attachment.filename)
+        prepared = await prepare_attachment(attachment, allow_url=False)
+        if not prepared:
+            return None
+        kind, tg_file, content_hash = prepared
+        tg_message = await send_prepared_attachment(kind, tg_file, attachment.filename, text, telegram_channel, reply_to=reply_to)
+    media_cache.remember_telegram_file(content_hash, kind, tg_message)
+    return tg_message
+
+async def process_attachment(attachment, text, telegram_channel, reply_to=None):
+    prepared = await prepare_attachment(attachment)
+    if not prepared:
+        return None
+    return await send_attachment(attachment, prepared, text, telegram_channel, reply_to=reply_to)
+
+def build_media_groups(prepared_items):
+    # Photos and videos may share an album, documents only go with documents;
+    # Telegram takes at most 10 items per sendMediaGroup
+    visual = [item for item in prepared_items if item[1] in ('photo', 'video')]
+    documents = [item for item in prepared_items if item[1] == 'document']
+    groups = []
+    for items in (visual, documents):
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+            groups.append(items[start:start + MEDIA_GROUP_LIMIT])
+    return groups
+
+async def send_media_group(group, caption, telegram_channel, reply_to=None):
+    # group is a list of (attachment, kind, file, content_hash); raises on failure
+    from telegram_bot import tg_bot
+
+    media = []
+    for index, (attachment, kind, tg_file, _) in enumerate(group):
+        item_caption = caption if index == 0 else None
+        if kind == 'photo':
+            media.append(telebot.types.InputMediaPhoto(tg_file, caption=item_caption, parse_mode='html'))
+        elif kind == 'video':
+            media.append(telebot.types.InputMediaVideo(tg_file, caption=item_caption, parse_mode='html'))
+        else:
+            media.append(telebot.types.InputMediaDocument(tg_file, caption=item_caption, parse_mode='html'))
+
+    if len(media) == 1:
+        attachment, kind, tg_file, content_hash = group[0]
+        tg_message = await send_prepared_attachment(kind, tg_file, attachment.filename, caption, telegram_channel, reply_to=reply_to)
+        if tg_message is None:
+            raise RuntimeError(f"Failed to send {attachment.filename}")
+        tg_messages = [tg_message]
+    else:
+        tg_messages = await telegram_sender.send(tg_bot.send_media_group, chat_id=int(telegram_channel), media=media, reply_to_message_id=reply_to)
+
+    for (_, kind, _, content_hash), tg_message in zip(group, tg_messages):
+        media_cache.remember_telegram_file(content_hash, kind, tg_message)
+    return tg_messages
+
+async def send_attachments(attachments, text, telegram_channel, reply_to=None):
+    """
+    Sends a message's attachments to Telegram as media groups, with the caption
+    on the first item only. Returns (sent Telegram messages, attachments that failed).
+    """
+    if len(attachments) == 1:
+        tg_message = await process_attachment(attachments[0], text, telegram_channel, reply_to=reply_to)
+        return ([tg_message], []) if tg_message else ([], list(attachments))
+
+    prepared = await asyncio.gather(*(prepare_attachment(attachment) for attachment in attachments))
+    failed = [attachment for attachment, item in zip(attachments, prepared) if not item]
+    prepared_items = [(attachment, *item) for attachment, item in zip(attachments, prepared) if item]
+
+    sent = []
+    caption = text
+    for group in build_media_groups(prepared_items):
+        if len(group) == 1:
+            attachment, kind, tg_file, content_hash = group[0]
+            tg_message = await send_attachment(attachment, (kind, tg_file, content_hash), caption, telegram_channel, reply_to=reply_to)
+            if tg_message:
+                sent.append(tg_message)
+                caption = None
+            else:
+                failed.append(attachment)
+            continue
+
+        try:
+            tg_messages = await send_media_group(group, caption, telegram_channel, reply_to=reply_to)
+        except Exception as e:
+            tg_messages = None
+            error = e
+            if any(tg_file == attachment.url for attachment, _, tg_file, _ in group):
+                # Telegram may have rejected one of the URLs: upload those items and retry once
+                logging.info("Media group with URLs failed (%s), uploading them instead", e)
+                retry_group = []
+                for attachment, kind, tg_file, content_hash in group:
+                    if tg_file == attachment.url:
+                        prepared_item = await prepare_attachment(attachment, allow_url=False)
+                        if not prepared_item:
+                            failed.append(attachment)
+                            continue
+                        kind, tg_file, content_hash = prepared_item
+                    retry_group.append((attachment, kind, tg_file, content_hash))
+                group = retry_group
+                if len(group) > 1:
+                    try:
+                        tg_messages = await send_media_group(group, caption, telegram_channel, reply_to=reply_to)
+                    except Exception as retry_error:
+                        error = retry_error
+
+            if tg_messages is None:
+                # One bad item fails the whole album: send the rest one by one,
+                # with the caption on the first item that goes through
+                if group:
+                    logging.warning("Media group of %s files failed (%s), sending them individually", len(group), error)
+                tg_messages = []
+                for attachment, kind, tg_file, content_hash in group:
+                    tg_message = await send_attachment(attachment, (kind, tg_file, content_hash), None if tg_messages else caption, telegram_channel, reply_to=reply_to)
+                    if tg_message:
+                        tg_messages.append(tg_message)
+                    else:
+                        failed.append(attachment)
+                if not tg_messages:
+                    continue
+
+        sent.extend(tg_messages)
+        caption = None
+
+    return sent, failed
 
 def format_mentions(message):
     user_message = str(message.content)
@@ -303,103 +563,3 @@ def format_mentions(message):
         return user_message
     else:
         return user_message
-
-def get_text_and_options(message, user_data, telegram_channel):
-    # HackBridge header handler: rewrite formatted headers from the HackBridge bot and drop link previews
-    hackbridge_payload = hackbridge_header_handler(
-        message, render_header=config.HACKBRIDGE_RENDER_HEADER
-    )
-    if hackbridge_payload:
-        return hackbridge_payload["text"], hackbridge_payload["disable_preview"]
-    return get_text(message, user_data, telegram_channel), False
-
-async def convert_heic_to_jpeg(file_bytes: bytes) -> BytesIO:
-    heif_file = pillow_heif.read_heif(file_bytes)
-    image = Image.frombytes(
-        heif_file.mode, 
-        heif_file.size, 
-        heif_file.data,
-        "raw"
-    )
-    output = BytesIO()
-    image.save(output, format='JPEG')
-    output.seek(0)
-    return output
-
-def get_discord_user_data(message):
-    if message:
-        user_name = message.author.display_name
-        user_id = message.author.id
-        message_id = message.id
-        text = message.content
-        channel_id = message.channel.id
-
-    return {
-        'user_name': user_name,
-        'user_id': user_id,
-        'message_id': message_id,
-        'text': text,
-        'channel_id': channel_id
-    }
-
-def load_channels_mapping():
-# Function to get the Telegram channel ID based on the Discord channel ID
-    try:    
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        discord_to_telegram = {item['discord_channel_id']: item['telegram_channel_id'] for item in channels_data['channels_mapping']}
-        return discord_to_telegram
-    except Exception as e:
-        logging.error("Error loading JSON from %s", file_path, exc_info=True)
-        raise
-
-def get_collection_name(telegram_channel_id):
-# Function to get the collection name based on the Telegram channel ID
-    try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        collection_mapping = {item['telegram_channel_id']: item['db_collection'] for item in channels_data['channels_mapping']}
-        collection_name = collection_mapping.get(telegram_channel_id)
-        return collection_name
-    except Exception as e:
-        logging.error("Error loading JSON from %s", file_path, exc_info=True)
-        raise
-    
-# ------------------------
-# Functions to check and set last message user ID
-# ------------------------
-
-def check_last_message_user_id(current_user_id:str, telegram_channel_id:str, discord_channel_id:str):
-    # Function to check if the last message user ID is the same as the current user ID
-
-    if discord_channel_id in config.DISCORD_CHANNEL_LAST_USER:
-        discord_channel_last_user_id = config.DISCORD_CHANNEL_LAST_USER[discord_channel_id]['user_id']
-        if discord_channel_last_user_id == current_user_id:
-            if telegram_channel_id in config.TELEGRAM_CHANNEL_LAST_USER:
-                telegram_channel_last_user_id = config.TELEGRAM_CHANNEL_LAST_USER[telegram_channel_id]['user_id']
-                if telegram_channel_last_user_id == str(config.TELEGRAM_BOT_ID):
-                    return True
-                else:   
-                    return False
-            else:
-                if config.DISCORD_CHANNEL_LAST_USER[discord_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                    # Check if the last message was sent less than 1 second ago
-                    return True
-                else:
-                    return False
-        else:
-            return False
-    else:
-        return False
-    
-def set_last_message_user_id(user_id:str, channel_id:str):
-    # Set the last message user ID for the current channel
-    config.DISCORD_CHANNEL_LAST_USER[channel_id] = {'user_id': user_id, 'timestamp': datetime.datetime.now(datetime.timezone.utc)}
-
-def update_last_message_user_id():
-    # delete expired object by timestamp after 1 minute 
-    for key in list(config.DISCORD_CHANNEL_LAST_USER.keys()):
-        if config.DISCORD_CHANNEL_LAST_USER[key]['timestamp'] < (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)):
-            del config.DISCORD_CHANNEL_LAST_USER[key]
@@ -0,0 +1,229 @@
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+import discord
+import config
+
+# ------------------------
+# Webhook pool for Telegram->Discord delivery
+# ------------------------
+# With DISCORD_DELIVERY = "webhook", messages from Telegram are posted through
+# webhooks owned by the bot instead of the bot account itself, with the
+# Telegram user's name as the webhook username. Each bridged channel gets
+# DISCORD_WEBHOOKS_PER_CHANNEL webhooks (reused across restarts), and sends
+# rotate over them so each webhook's rate-limit bucket takes a share of the load.
+# Pools are loaded for every cached channel on (re)connect, and lazily on first
+# send for channels bridged later by a routes reload or whose webhook was deleted.
+# Channels where the bot lacks Manage Webhooks keep using the bot account until
+# the next reconnect. Messages from a webhook outside the loaded pools (e.g. one
+# posted before its pool was loaded) are recognised by the webhook's name and owner.
+
+WEBHOOK_NAME = "Telegram Bridge"
+USERNAME_MAX_LENGTH = 80
+# Discord rejects webhook usernames containing these words
+RESERVED_USERNAME_WORDS = re.compile(r'(?i)(disc)(ord)|(cly)(de)')
+# Recent message ID -> webhook that posted it, for edits (only that webhook may edit)
+SENT_HISTORY = 1024
+# Webhooks outside the pools whose owner was looked up
+CHECKED_HISTORY = 256
+
+class WebhookPool:
+    __slots__ = ('webhooks', 'next_index')
+
+    def __init__(self, webhooks):
+        self.webhooks = webhooks
+        self.next_index = 0
+
+    def take(self):
+        webhook = self.webhooks[self.next_index % len(self.webhooks)]
+        self.next_index += 1
+        return webhook
+
+_pools = {}  # channel id -> WebhookPool
+_loading = {}  # channel id -> task loading its pool
+_unavailable = set()  # channel ids where setting up webhooks failed
+_webhook_ids = set()
+_checked = OrderedDict()  # webhook id -> posted by the bridge
+_sent_by = OrderedDict()
+_bot_user = None
+_application_id = None
+
+def enabled():
+    return config.DISCORD_DELIVERY == "webhook"
+
+async def is_bridge_message(message):
+    """
+    True when message was posted by one of the bridge's webhooks, i.e. it came
+    from Telegram and must not be relayed back.
+    """
+    webhook_id = message.webhook_id
+    if webhook_id is None or _bot_user is None:
+        return False
+    if webhook_id in _webhook_ids:
+        return True
+    own = _checked.get(webhook_id)
+    if own is None:
+        own = _checked[webhook_id] = await _is_own_webhook(message, webhook_id)
+        while len(_checked) > CHECKED_HISTORY:
+            _checked.popitem(last=False)
+    return own
+
+async def _is_own_webhook(message, webhook_id):
+    try:
+        webhooks = await _webhook_channel(message.channel).webhooks()
+    except discord.HTTPException:
+        # Can't list them (no Manage Webhooks): fall back on the application that owns the webhook
+        return _application_id is not None and message.application_id == _application_id
+    return any(
+        webhook.id == webhook_id and webhook.name == WEBHOOK_NAME and webhook.user == _bot_user
+        for webhook in webhooks
+    )
+
+def _webhook_channel(channel):
+    # Webhooks live on the parent channel and post into threads with thread=
+    return channel.parent if isinstance(channel, discord.Thread) else channel
+
+async def _load_pool(channel, bot_user):
+    target = _webhook_channel(channel)
+    existing = [
+        webhook for webhook in await target.webhooks()
+        if webhook.name == WEBHOOK_NAME and webhook.user == bot_user and webhook.token
+    ]
+    while len(existing) < config.DISCORD_WEBHOOKS_PER_CHANNEL:
+        existing.append(await target.create_webhook(name=WEBHOOK_NAME, reason="Telegram bridge delivery"))
+    return WebhookPool(existing[:config.DISCORD_WEBHOOKS_PER_CHANNEL])
+
+async def _add_pool(channel):
+    try:
+        pool = await _load_pool(channel, _bot_user)
+    except discord.Forbidden:
+        logging.warning("Missing Manage Webhooks in Discord channel %s, delivering as the bot there", channel.id)
+        _unavailable.add(channel.id)
+        return None
+    except Exception:
+        logging.error("Failed to set up webhooks for Discord channel %s", channel.id, exc_info=True)
+        _unavailable.add(channel.id)
+        return None
+    _pools[channel.id] = pool
+    _webhook_ids.update(webhook.id for webhook in pool.webhooks)
+    return pool
+
+async def _get_pool(channel):
+    pool = _pools.get(channel.id)
+    if _bot_user is None or channel.id in _unavailable:
+        return pool
+    if pool is not None and len(pool.webhooks) >= config.DISCORD_WEBHOOKS_PER_CHANNEL:
+        return pool
+    # Concurrent sends to a new channel share one load instead of each creating
+    # webhooks; a pool that lost a webhook keeps serving while it is refilled
+    task = _loading.get(channel.id)
+    if task is None:
+        task = _loading[channel.id] = asyncio.ensure_future(_add_pool(channel))
+        task.add_done_callback(lambda _: _loading.pop(channel.id, None))
+    if pool is not None:
+        return pool
+    return await asyncio.shield(task)
+
+async def setup(channels, bot_user, application_id):
+    """
+    Loads or creates the webhook pool of every bridged channel. Runs on each
+    (re)connect after the channel cache is warmed.
+    """
+    global _bot_user, _application_id
+    if not enabled():
+        return
+    _bot_user = bot_user
+    _application_id = application_id
+    _unavailable.clear()
+    for channel in channels:
+        if channel.id not in _pools:
+            await _add_pool(channel)
+    logging.info("Webhook delivery ready for %s Discord channels", len(_pools))
+
+def forget_channel(channel_id):
+    # The webhook IDs stay known: messages they already posted are still bridge output
+    _unavailable.discard(channel_id)
+    _pools.pop(channel_id, None)
+
+def _drop_webhook(channel_id, webhook):
+    # Only this webhook is gone: the rest of the pool keeps posting (and stays
+    # recognised) while the next send refills it
+    _webhook_ids.discard(webhook.id)
+    pool = _pools.get(channel_id)
+    if pool is not None and webhook in pool.webhooks:
+        pool.webhooks.remove(webhook)
+        if not pool.webhooks:
+            del _pools[channel_id]
+
+def make_username(name):
+    name = RESERVED_USERNAME_WORDS.sub(lambda m: '\u200b'.join(part for part in m.groups() if part), name or '').strip()
+    return name[:USERNAME_MAX_LENGTH] or "Telegram"
+
+def reply_line(channel, message_id):
+    # Webhook messages can't carry a message reference, so replies link the target instead
+    guild_id = channel.guild.id if getattr(channel, 'guild', None) else '@me'
+    return f"-# ↪ https://discord.com/channels/{guild_id}/{channel.id}/{message_id}"
+
+async def send(channel, content, username, files=None, reply_to=None):
+    """
+    Posts through the channel's webhook pool and returns the WebhookMessage,
+    or None if nothing was sent and the bot should deliver it instead: the
+    channel has no pool, or its webhook was deleted. files are closed after
+    any attempt to send them.
+    """
+    pool = await _get_pool(channel)
+    if pool is None:
+        return None
+
+    if reply_to:
+        content = f"{reply_line(channel, reply_to)}\n{content}" if content else reply_line(channel, reply_to)
+    kwargs = {'thread': channel} if isinstance(channel, discord.Thread) else {}
+    webhook = pool.take()
+    try:
+        message = await webhook.send(
+            content=content or None,
+            username=make_username(username),
+            files=files or discord.utils.MISSING,
+            allowed_mentions=discord.AllowedMentions(everyone=False, roles=False),
+            wait=True,
+            **kwargs,
+        )
+    except discord.NotFound:
+        # A webhook was deleted from the channel: this message goes out as the bot,
+        # and the next send refills the pool
+        logging.warning("Bridge webhook %s in Discord channel %s is gone, falling back to the bot", webhook.id, channel.id)
+        _drop_webhook(channel.id, webhook)
+        return None
+
+    _sent_by[message.id] = webhook
+    while len(_sent_by) > SENT_HISTORY:
+        _sent_by.popitem(last=False)
+    return message
+
+async def edit(channel, message_id, content, reply_to=None):
+    """
+    Edits a message posted through the channel's webhook pool. Returns False
+    if none of the channel's webhooks posted it (it was sent by the bot).
+    """
+    pool = _pools.get(channel.id)
+    if pool is None:
+        return False
+
+    if reply_to:
+        content = f"{reply_line(channel, reply_to)}\n{content}" if content else reply_line(channel, reply_to)
+    kwargs = {'thread': channel} if isinstance(channel, discord.Thread) else {}
+    known = _sent_by.get(int(message_id))
+    # After a restart the sender isn't known: the pool is small, so try each webhook
+    for webhook in [known] if known else pool.webhooks:
+        try:
+            await webhook.edit_message(
+                int(message_id),
+                content=content or None,
+                allowed_mentions=discord.AllowedMentions(everyone=False, roles=False),
+                **kwargs,
+            )
+        except (discord.NotFound, discord.Forbidden):
+            continue
+        return True
+    return False
@@ -0,0 +1,134 @@
+import io
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+import pillow_heif
+import config
+
+# ------------------------
+# Image pipeline for Discord->Telegram photos
+# ------------------------
+# Decoding and encoding run in a process pool so CPU-heavy images never block
+# the event loop. Images Telegram accepts as they are pass through untouched
+# (only the header is read); HEIC files and images over Telegram's photo limits
+# are decoded at reduced scale (JPEG draft mode / Image.reduce) where possible,
+# rotated upright from their EXIF orientation, downscaled to IMAGE_MAX_SIDE and
+# re-encoded: as PNG when the source is a PNG or has transparency (so alpha
+# isn't flattened to black), as JPEG otherwise or when the PNG is still too big.
+
+HEIC_EXTENSIONS = ('.heic', '.heif')
+# sendPhoto limits: 10 MB, width + height <= 10000, aspect ratio <= 20
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+TELEGRAM_PHOTO_MAX_DIMENSIONS = 10000
+JPEG_QUALITY = 85
+
+_pool = None
+stats = {'passthrough': 0, 'converted': 0, 'failed': 0}
+
+def _init_worker():
+    pillow_heif.register_heif_opener()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the bot process already runs threads (mapping store,
+        # routes watcher, to_thread workers) whose locks a forked child could inherit held
+        _pool = ProcessPoolExecutor(max_workers=config.IMAGE_WORKERS, initializer=_init_worker, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def is_heic(file_name):
+    return file_name.lower().endswith(HEIC_EXTENSIONS)
+
+def _fits_telegram(image, size):
+    width, height = image.size
+    return (
+        size <= TELEGRAM_PHOTO_MAX_BYTES
+        and width + height <= TELEGRAM_PHOTO_MAX_DIMENSIONS
+        and max(width, height) <= config.IMAGE_MAX_SIDE
+    )
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+def _process_image(data, heic, max_side):
+    """
+    Runs in a worker process. Returns PNG or JPEG bytes, or None when the
+    original can be sent as is.
+    """
+    image = Image.open(io.BytesIO(data))
+    if not heic and _fits_telegram(image, len(data)):
+        return None
+
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale
+    source_format = image.format
+    if source_format == 'JPEG':
+        image.draft('RGB', (max_side, max_side))
+    image.load()
+    # Re-encoding drops the EXIF orientation tag, so apply it to the pixels
+    image = ImageOps.exif_transpose(image)
+    keep_png = source_format == 'PNG' or _has_alpha(image)
+    if keep_png and image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+
+    # Cheap integer box reduction first, then a proper resample for the rest
+    factor = max(image.size) // max_side
+    if factor >= 2:
+        image = image.reduce(factor)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if keep_png:
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+        if output.tell() <= TELEGRAM_PHOTO_MAX_BYTES:
+            return output.getvalue()
+
+    if _has_alpha(image):
+        # JPEG has no alpha: flatten onto white rather than black
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+async def prepare_photo(data, file_name):
+    """
+    Returns image bytes Telegram accepts as a photo: the original bytes when
+    they already fit, otherwise a downscaled PNG or JPEG. Raises if the image
+    can't be decoded.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_get_pool(), _process_image, data, is_heic(file_name), config.IMAGE_MAX_SIDE)
+    except BrokenProcessPool:
+        # A worker died; shut the broken pool down and start a new one next time
+        pool, _pool = _pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        stats['failed'] += 1
+        raise
+    except Exception:
+        stats['failed'] += 1
+        raise
+
+    if result is None:
+        stats['passthrough'] += 1
+        return data
+    stats['converted'] += 1
+    logging.debug("Converted image %s: %s -> %s bytes", file_name, len(data), len(result))
+    return result
+
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+
+def get_stats():
+    return dict(stats)
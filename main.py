@@ -1,23 +1,72 @@
 import asyncio
-import threading
+import logging
 import config
 from dotenv import load_dotenv
 from discord_bot import discord_client
-from telegram_bot import tg_bot, run_telegram, set_discord_loop
+from telegram_bot import tg_bot, connect_telegram, run_telegram
 from logger_setup import setup_logger 
+import routes
+import mapping_store
+import telegram_webhook
+import telegram_sender
+import telegram_media
+import media_cache
+import transcoder
+import stickers
+import image_pipeline
+import message_bursts
+import message_edits
 
 load_dotenv()
-setup_logger()
 
 DISCORD_TOKEN = config.DISCORD_TOKEN
 
-if __name__ == "__main__":
-    discord_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(discord_loop)
+async def start_telegram_ingest():
+    # Webhook mode when configured, long polling otherwise or if the webhook fails
+    if config.TELEGRAM_MODE == "webhook":
+        try:
+            return None, await telegram_webhook.start_webhook(tg_bot)
+        except Exception:
+            logging.error("Telegram webhook setup failed, falling back to polling", exc_info=True)
+    return asyncio.create_task(run_telegram()), None
+
+async def run_bridge():
+    # Telegram and Discord share this single event loop
+    await connect_telegram()
+    telegram_task, webhook_runner = await start_telegram_ingest()
+    try:
+        await discord_client.start(DISCORD_TOKEN)
+    finally:
+        if telegram_task:
+            telegram_task.cancel()
+        if webhook_runner:
+            await telegram_webhook.stop_webhook(tg_bot, webhook_runner)
+        await tg_bot.close_session()
+        await telegram_media.close_http_session()
+        await transcoder.shutdown()
+        stickers.shutdown()
+        image_pipeline.shutdown()
+        logging.info("Telegram send queue stats: %s", telegram_sender.get_stats())
+        logging.info("Media cache stats: %s", media_cache.get_stats())
+        logging.info("Transcoder stats: %s", transcoder.get_stats())
+        logging.info("Sticker conversion stats: %s", stickers.get_stats())
+        logging.info("Image pipeline stats: %s", image_pipeline.get_stats())
+        logging.info("Message burst stats: %s", message_bursts.get_stats())
+        logging.info("Message edit stats: %s", message_edits.get_stats())
 
-    set_discord_loop(discord_loop)
+if __name__ == "__main__":
+    # Not at import time: spawned worker processes import this module too
+    setup_logger()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
 
-    tg_thread = threading.Thread(target=run_telegram)
-    tg_thread.start()
+    mapping_store.init().ensure_collections({route.collection_name for route in routes.all_routes() if route.collection_name})
+    routes.start_watcher()
+    routes.install_sighup_handler()
+    media_cache.load_index()
 
-    discord_loop.run_until_complete(discord_client.start(DISCORD_TOKEN))
+    try:
+        loop.run_until_complete(run_bridge())
+    finally:
+        mapping_store.shutdown()
+        media_cache.save_index()
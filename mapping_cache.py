@@ -0,0 +1,137 @@
+from array import array
+import config
+
+# ------------------------
+# Recent telegram<->discord message-ID cache
+# ------------------------
+# Almost every reply targets one of the last few hundred messages, so the
+# last N pairs per collection are kept in a ring of two signed 64-bit integer
+# arrays (16 bytes per pair). Lookups go through two open-addressed hash
+# tables of 32-bit ring slots (slot + 1, 0 = empty) kept at most half full,
+# so an entry costs about 32 bytes in total and no per-pair Python objects.
+# A byte per slot records which platform the pair's source message was on.
+
+SOURCE_CODES = {None: 0, 'telegram': 1, 'discord': 2}
+
+def _probe_start(key, mask):
+    # Fibonacci hashing spreads the mostly sequential message IDs
+    return ((key * 0x9E3779B97F4A7C15) >> 32) & mask
+
+class RecentMappings:
+    __slots__ = ('size', 'mask', 'telegram_ids', 'discord_ids', 'sources', 'by_telegram', 'by_discord', 'position', 'count')
+
+    def __init__(self, size):
+        self.size = size
+        capacity = 1
+        while capacity < 2 * size:
+            capacity *= 2
+        self.mask = capacity - 1
+        self.telegram_ids = array('q', bytes(8 * size))
+        self.discord_ids = array('q', bytes(8 * size))
+        self.sources = bytearray(size)
+        self.by_telegram = array('i', bytes(4 * capacity))
+        self.by_discord = array('i', bytes(4 * capacity))
+        self.position = 0
+        self.count = 0
+
+    def _find(self, table, keys, key):
+        # Returns the table index holding key, or the empty index where it would go
+        mask = self.mask
+        index = _probe_start(key, mask)
+        while True:
+            entry = table[index]
+            if not entry or keys[entry - 1] == key:
+                return index
+            index = (index + 1) & mask
+
+    def _remove(self, table, keys, slot):
+        index = self._find(table, keys, keys[slot])
+        if table[index] != slot + 1:
+            # The key was re-added later and now points at a newer slot
+            return
+        # Backward-shift deletion keeps every probe chain unbroken
+        mask = self.mask
+        hole = index
+        while True:
+            index = (index + 1) & mask
+            entry = table[index]
+            if not entry:
+                break
+            home = _probe_start(keys[entry - 1], mask)
+            if (index - home) & mask >= (index - hole) & mask:
+                table[hole] = entry
+                hole = index
+        table[hole] = 0
+
+    def add(self, telegram_message_id, discord_message_id, source=None):
+        slot = self.position
+        if self.count == self.size:
+            # Evict the oldest pair occupying this slot
+            self._remove(self.by_telegram, self.telegram_ids, slot)
+            self._remove(self.by_discord, self.discord_ids, slot)
+        else:
+            self.count += 1
+
+        self.telegram_ids[slot] = telegram_message_id
+        self.discord_ids[slot] = discord_message_id
+        self.sources[slot] = SOURCE_CODES[source]
+        self.by_telegram[self._find(self.by_telegram, self.telegram_ids, telegram_message_id)] = slot + 1
+        # Keep the first Telegram message for a multi-attachment Discord message
+        index = self._find(self.by_discord, self.discord_ids, discord_message_id)
+        if not self.by_discord[index]:
+            self.by_discord[index] = slot + 1
+        self.position = (slot + 1) % self.size
+
+    def get_discord_message_id(self, telegram_message_id):
+        entry = self.by_telegram[self._find(self.by_telegram, self.telegram_ids, telegram_message_id)]
+        if not entry:
+            return None
+        return self.discord_ids[entry - 1]
+
+    def get_telegram_message_id(self, discord_message_id, source=None):
+        # With source, only a pair recorded from that platform counts
+        entry = self.by_discord[self._find(self.by_discord, self.discord_ids, discord_message_id)]
+        if not entry or (source is not None and self.sources[entry - 1] != SOURCE_CODES[source]):
+            return None
+        return self.telegram_ids[entry - 1]
+
+_caches = {}
+stats = {'hits': 0, 'misses': 0}
+_cache_size = config.MAPPING_CACHE_SIZE
+
+def configure(size):
+    global _cache_size
+    _cache_size = size
+    _caches.clear()
+
+def _get_cache(collection_name):
+    cache = _caches.get(collection_name)
+    if cache is None:
+        cache = _caches[collection_name] = RecentMappings(_cache_size)
+    return cache
+
+def remember(telegram_message_id, discord_message_id, collection_name, source=None):
+    if _cache_size <= 0:
+        return
+    _get_cache(collection_name).add(int(telegram_message_id), int(discord_message_id), source)
+
+def lookup_discord_message_id(telegram_message_id, collection_name):
+    cache = _caches.get(collection_name)
+    result = cache.get_discord_message_id(int(telegram_message_id)) if cache else None
+    stats['hits' if result is not None else 'misses'] += 1
+    return result
+
+def lookup_telegram_message_id(discord_message_id, collection_name, source=None):
+    cache = _caches.get(collection_name)
+    result = cache.get_telegram_message_id(int(discord_message_id), source) if cache else None
+    stats['hits' if result is not None else 'misses'] += 1
+    return result
+
+def get_stats():
+    total = stats['hits'] + stats['misses']
+    return {
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_ratio': stats['hits'] / total if total else 0.0,
+        'collections': {name: cache.count for name, cache in _caches.items()},
+    }
@@ -0,0 +1,183 @@
+import asyncio
+import functools
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import config
+import routes
+import storage
+import mapping_cache
+
+# ------------------------
+# Async access to the message-ID mapping store
+# ------------------------
+# The backend comes from storage.create_storage(). Blocking backends (Mongo,
+# SQLite) are called through a small dedicated executor instead of running on
+# the Discord event loop. The pool is bounded by config.DB_POOL_SIZE so a burst
+# of messages can't open unbounded threads.
+#
+# Inserts are write-behind: save_message() only buffers the pair, and the
+# buffer is flushed with insert_many when it reaches MAPPING_FLUSH_SIZE, every
+# MAPPING_FLUSH_INTERVAL seconds and on shutdown. Lookups check the buffer
+# first so replies to not-yet-flushed messages still resolve.
+#
+# In front of both sits mapping_cache, which answers most reply lookups for
+# recent messages without touching the buffer or Mongo.
+
+_executor = ThreadPoolExecutor(max_workers=config.DB_POOL_SIZE, thread_name_prefix='mapping-store')
+_backend = None
+
+# collection -> [(telegram_message_id, discord_message_id, kind, source), ...] waiting for flush
+_pending = {}
+# collection -> {id: counterpart id} (Discord side: [(counterpart id, source), ...]);
+# kept until the flush containing the row completes
+_pending_by_telegram = {}
+_pending_by_discord = {}
+_flush_task = None
+
+def init(backend=None):
+    # Select and open the storage backend; called once from main.py
+    global _backend
+    _backend = storage.create_storage(backend)
+    return _backend
+
+def get_backend():
+    if _backend is None:
+        init()
+    return _backend
+
+async def _run(func, *args, **kwargs):
+    if not get_backend().blocking:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+# ------------------------
+# Write-behind buffer
+# ------------------------
+
+def _forget_pending(batch, collection_name):
+    by_telegram = _pending_by_telegram.get(collection_name, {})
+    by_discord = _pending_by_discord.get(collection_name, {})
+    for telegram_message_id, discord_message_id, _, source in batch:
+        if by_telegram.get(telegram_message_id) == discord_message_id:
+            del by_telegram[telegram_message_id]
+        rows = by_discord.get(discord_message_id)
+        if rows is not None and (telegram_message_id, source) in rows:
+            rows.remove((telegram_message_id, source))
+            if not rows:
+                del by_discord[discord_message_id]
+
+async def flush(collection_name):
+    batch = _pending.pop(collection_name, None)
+    if not batch:
+        return
+    try:
+        await _run(get_backend().save_messages, batch, collection_name=collection_name)
+        logging.debug("Flushed %s mappings to %s", len(batch), collection_name)
+    finally:
+        _forget_pending(batch, collection_name)
+
+async def flush_all():
+    for collection_name in list(_pending):
+        await flush(collection_name)
+
+async def purge_expired():
+    # Enforce MAPPING_RETENTION_DAYS on every routed collection
+    if config.MAPPING_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=config.MAPPING_RETENTION_DAYS)
+    collection_names = {route.collection_name for route in routes.all_routes() if route.collection_name}
+    deleted = await _run(get_backend().purge_expired, collection_names, cutoff, archive_dir=config.MAPPING_ARCHIVE_DIR)
+    if deleted:
+        logging.info("Expired %s message mappings older than %s", deleted, cutoff)
+    return deleted
+
+async def _flush_periodically():
+    loop = asyncio.get_running_loop()
+    next_purge = loop.time()
+    while True:
+        await asyncio.sleep(config.MAPPING_FLUSH_INTERVAL)
+        try:
+            await flush_all()
+        except Exception:
+            logging.error("Error flushing message mappings", exc_info=True)
+
+        if loop.time() >= next_purge:
+            next_purge = loop.time() + config.MAPPING_PURGE_INTERVAL
+            try:
+                await purge_expired()
+            except Exception:
+                logging.error("Error expiring message mappings", exc_info=True)
+
+def _ensure_flush_task():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.get_running_loop().create_task(_flush_periodically())
+
+# ------------------------
+# Public API
+# ------------------------
+
+async def save_message(telegram_message_id, discord_message_id, collection_name, kind=None, source=None):
+    # source: platform the original message was posted on ('telegram' or 'discord')
+    _ensure_flush_task()
+    mapping_cache.remember(telegram_message_id, discord_message_id, collection_name, source)
+    _pending.setdefault(collection_name, []).append((telegram_message_id, discord_message_id, kind, source))
+    _pending_by_telegram.setdefault(collection_name, {})[telegram_message_id] = discord_message_id
+    # In order, so the first row matches find_one on the stored rows
+    _pending_by_discord.setdefault(collection_name, {}).setdefault(discord_message_id, []).append((telegram_message_id, source))
+
+    if len(_pending[collection_name]) >= config.MAPPING_FLUSH_SIZE:
+        await flush(collection_name)
+
+async def get_discord_message_id(telegram_message_id, collection_name):
+    cached = mapping_cache.lookup_discord_message_id(telegram_message_id, collection_name)
+    if cached is not None:
+        return cached
+    pending = _pending_by_telegram.get(collection_name)
+    if pending and telegram_message_id in pending:
+        return pending[telegram_message_id]
+    return await _run(get_backend().get_discord_message_id, telegram_message_id=telegram_message_id, collection_name=collection_name)
+
+async def get_telegram_message_id(discord_message_id, collection_name, source=None):
+    # With source, only mappings recorded from that platform count (rows saved
+    # before sources were recorded never match)
+    cached = mapping_cache.lookup_telegram_message_id(discord_message_id, collection_name, source)
+    if cached is not None:
+        return cached
+    pending = _pending_by_discord.get(collection_name)
+    if pending and discord_message_id in pending:
+        for telegram_message_id, pending_source in pending[discord_message_id]:
+            if source is None or pending_source == source:
+                return telegram_message_id
+        return None
+    return await _run(get_backend().get_telegram_message_id, discord_message_id=discord_message_id, collection_name=collection_name, source=source)
+
+async def get_telegram_message_ids(discord_message_id, collection_name, source=None):
+    # Every Telegram message bridged from a Discord message (one per attachment
+    # sent), stored or still buffered, oldest first
+    telegram_message_ids = await _run(get_backend().get_telegram_message_ids, discord_message_id=discord_message_id, collection_name=collection_name, source=source)
+    pending = _pending_by_discord.get(collection_name, {}).get(discord_message_id, ())
+    for telegram_message_id, pending_source in list(pending):
+        if (source is None or pending_source == source) and telegram_message_id not in telegram_message_ids:
+            telegram_message_ids.append(telegram_message_id)
+    return telegram_message_ids
+
+def get_cache_stats():
+    return mapping_cache.get_stats()
+
+def shutdown(wait=True):
+    # The event loop has stopped by now, so whatever is still buffered is
+    # written synchronously before the executor goes away
+    if _flush_task is not None:
+        _flush_task.cancel()
+    for collection_name in list(_pending):
+        batch = _pending.pop(collection_name)
+        logging.info("Flushing %s buffered mappings to %s on shutdown", len(batch), collection_name)
+        get_backend().save_messages(batch, collection_name=collection_name)
+    logging.info("Mapping cache stats: %s", mapping_cache.get_stats())
+    logging.debug("Shutting down mapping store executor")
+    _executor.shutdown(wait=wait)
+    if _backend is not None:
+        _backend.close()
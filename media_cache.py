@@ -0,0 +1,301 @@
+import os
+import json
+import asyncio
+import uuid
+import hashlib
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import config
+
+# ------------------------
+# Content-addressed media cache
+# ------------------------
+# Entries are keyed by SHA-256 of the original content, with Telegram's
+# file_unique_id as a second key. An entry may hold:
+#   - a converted local copy, so Telegram->Discord repeats skip download and ffmpeg
+#   - the Telegram file_id and kind, so Discord->Telegram repeats are sent by
+#     file_id with no upload
+# Discord attachment URLs are not kept: they are signed and expire, so they
+# can't be handed out again later.
+# Entries are kept in LRU order and bounded by MEDIA_CACHE_MAX_BYTES of local
+# copies and MEDIA_CACHE_MAX_ENTRIES overall. The index is written atomically to
+# <MEDIA_CACHE_DIR>/index.json every MEDIA_CACHE_SAVE_INTERVAL seconds after a
+# change and on shutdown. On startup, cached files the index doesn't know about
+# (e.g. after a crash) are adopted again by the content hash in their name.
+
+INDEX_FILE = 'index.json'
+HASH_LENGTH = 64
+
+class CacheEntry:
+    __slots__ = ('content_hash', 'path', 'size', 'file_unique_id', 'telegram_file_id', 'telegram_kind')
+
+    def __init__(self, content_hash, path=None, size=0, file_unique_id=None, telegram_file_id=None, telegram_kind=None):
+        self.content_hash = content_hash
+        self.path = path
+        self.size = size
+        self.file_unique_id = file_unique_id
+        self.telegram_file_id = telegram_file_id
+        self.telegram_kind = telegram_kind
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+_entries = OrderedDict()  # content_hash -> CacheEntry, least recently used first
+_by_unique_id = {}
+_total_bytes = 0
+_dirty = False
+_save_task = None
+_version = 0  # bumped per snapshot so an older write never replaces a newer index
+_written_version = 0
+_write_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'file_id_reuses': 0}
+
+# ------------------------
+# Internal helpers
+# ------------------------
+
+def _touch(entry):
+    _entries.move_to_end(entry.content_hash)
+
+def _mark_dirty():
+    # Called after every change; schedules a save when running on the event loop
+    global _dirty, _save_task
+    _dirty = True
+    if _save_task is None or _save_task.done():
+        try:
+            _save_task = asyncio.get_running_loop().create_task(_save_periodically())
+        except RuntimeError:
+            pass
+
+async def _save_periodically():
+    while True:
+        await asyncio.sleep(config.MEDIA_CACHE_SAVE_INTERVAL)
+        if not _dirty:
+            return
+        try:
+            # Snapshot on the loop, write the file off it
+            await asyncio.to_thread(_write_index, _snapshot())
+        except Exception:
+            logging.error("Error saving media cache index", exc_info=True)
+
+def _drop_file(entry):
+    global _total_bytes
+    if not entry.path:
+        return
+    _total_bytes -= entry.size
+    try:
+        os.remove(entry.path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning("Failed to remove cached media %s: %s", entry.path, e)
+    entry.path, entry.size = None, 0
+
+def _drop(entry):
+    _entries.pop(entry.content_hash, None)
+    if entry.file_unique_id and _by_unique_id.get(entry.file_unique_id) == entry.content_hash:
+        del _by_unique_id[entry.file_unique_id]
+    _drop_file(entry)
+
+def _evict():
+    # Over the byte budget only the local copy goes; the (tiny) IDs stay until the entry limit
+    if _total_bytes > config.MEDIA_CACHE_MAX_BYTES:
+        for entry in list(_entries.values()):
+            if _total_bytes <= config.MEDIA_CACHE_MAX_BYTES:
+                break
+            _drop_file(entry)
+    while len(_entries) > config.MEDIA_CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries.values())))
+
+def _get_or_create(content_hash):
+    entry = _entries.get(content_hash)
+    if entry is None:
+        entry = _entries[content_hash] = CacheEntry(content_hash)
+    _touch(entry)
+    return entry
+
+def _link_or_copy(source, target):
+    # Hard links make handing out a cached file free; fall back to copying across filesystems
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def content_hash_from_path(path):
+    # Downloaded files are named <sha256><ext> (or <sha256>_compressed.mp4)
+    name = os.path.basename(path)
+    prefix = name[:HASH_LENGTH]
+    if len(prefix) == HASH_LENGTH and all(c in '0123456789abcdef' for c in prefix):
+        return prefix
+    return None
+
+# ------------------------
+# Lookups
+# ------------------------
+
+def checkout_by_unique_id(file_unique_id, target_dir):
+    """
+    Returns a fresh path in target_dir holding the cached (already converted)
+    file for a Telegram file_unique_id, or None on a miss. The caller owns and
+    may delete the returned path.
+    """
+    content_hash = _by_unique_id.get(file_unique_id)
+    entry = _entries.get(content_hash) if content_hash else None
+    if entry is None or not entry.path or not os.path.exists(entry.path):
+        stats['misses'] += 1
+        return None
+
+    _touch(entry)
+    os.makedirs(target_dir, exist_ok=True)
+    # Unique name per checkout (hash prefix kept) so concurrent sends don't delete each other's copy
+    base, ext = os.path.splitext(os.path.basename(entry.path))
+    target = os.path.join(target_dir, f"{base}_{uuid.uuid4().hex[:8]}{ext}")
+    _link_or_copy(entry.path, target)
+    stats['hits'] += 1
+    return target
+
+def get_telegram_file_id(content_hash, kind):
+    # A Telegram file_id can only be re-sent with the same kind of method
+    entry = _entries.get(content_hash)
+    if entry is None or not entry.telegram_file_id or entry.telegram_kind != kind:
+        return None
+    _touch(entry)
+    stats['file_id_reuses'] += 1
+    return entry.telegram_file_id
+
+# ------------------------
+# Recording
+# ------------------------
+
+def store_file(local_path, content_hash, file_unique_id=None, telegram_file_id=None, telegram_kind=None):
+    # Keeps a hard-linked copy of a downloaded/converted file under MEDIA_CACHE_DIR
+    global _total_bytes
+    if config.MEDIA_CACHE_MAX_BYTES <= 0 or not local_path or not content_hash:
+        return
+    entry = _get_or_create(content_hash)
+    if file_unique_id:
+        entry.file_unique_id = file_unique_id
+        _by_unique_id[file_unique_id] = content_hash
+    if telegram_file_id and telegram_kind:
+        entry.telegram_file_id = telegram_file_id
+        entry.telegram_kind = telegram_kind
+
+    if entry.path and os.path.exists(entry.path):
+        return
+    try:
+        os.makedirs(config.MEDIA_CACHE_DIR, exist_ok=True)
+        cache_path = os.path.join(config.MEDIA_CACHE_DIR, os.path.basename(local_path))
+        if not os.path.exists(cache_path):
+            _link_or_copy(local_path, cache_path)
+        entry.path = cache_path
+        entry.size = os.path.getsize(cache_path)
+        _total_bytes += entry.size
+    except Exception as e:
+        logging.warning("Failed to cache media %s: %s", local_path, e)
+    _evict()
+    _mark_dirty()
+
+def remember_telegram_file(content_hash, kind, tg_message):
+    # Records the file_id Telegram assigned to something we uploaded
+    if not content_hash or tg_message is None:
+        return
+    if kind == 'photo' and tg_message.photo:
+        file_id = tg_message.photo[-1].file_id
+    elif kind == 'video' and tg_message.video:
+        file_id = tg_message.video.file_id
+    elif kind == 'document' and tg_message.document:
+        file_id = tg_message.document.file_id
+    else:
+        return
+    entry = _get_or_create(content_hash)
+    entry.telegram_file_id = file_id
+    entry.telegram_kind = kind
+    _evict()
+    _mark_dirty()
+
+# ------------------------
+# Persistence
+# ------------------------
+
+def load_index():
+    global _total_bytes
+    index_path = os.path.join(config.MEDIA_CACHE_DIR, INDEX_FILE)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except Exception:
+            logging.error("Error loading media cache index %s", index_path, exc_info=True)
+            items = []
+
+        for item in items:
+            # Ignore fields dropped since the index was written
+            entry = CacheEntry(**{name: value for name, value in item.items() if name in CacheEntry.__slots__})
+            if entry.path and not os.path.exists(entry.path):
+                entry.path, entry.size = None, 0
+            _entries[entry.content_hash] = entry
+            _total_bytes += entry.size
+            if entry.file_unique_id:
+                _by_unique_id[entry.file_unique_id] = entry.content_hash
+
+    adopted = _adopt_unindexed_files()
+    _evict()
+    logging.info("Loaded %s media cache entries (%s bytes, %s files adopted from disk)", len(_entries), _total_bytes, adopted)
+
+def _adopt_unindexed_files():
+    # Files stored after the last index save are still named by content hash
+    global _total_bytes
+    if not os.path.isdir(config.MEDIA_CACHE_DIR):
+        return 0
+    indexed = {entry.path for entry in _entries.values() if entry.path}
+    adopted = 0
+    for name in os.listdir(config.MEDIA_CACHE_DIR):
+        path = os.path.join(config.MEDIA_CACHE_DIR, name)
+        content_hash = content_hash_from_path(path)
+        if content_hash is None or path in indexed or not os.path.isfile(path):
+            continue
+        entry = _entries.get(content_hash)
+        if entry is None:
+            # Least recently used, so unknown files are the first to go
+            entry = _entries[content_hash] = CacheEntry(content_hash)
+            _entries.move_to_end(content_hash, last=False)
+        elif entry.path:
+            continue
+        entry.path = path
+        entry.size = os.path.getsize(path)
+        _total_bytes += entry.size
+        adopted += 1
+    return adopted
+
+def _snapshot():
+    global _dirty, _version
+    _dirty = False
+    _version += 1
+    return _version, [entry.to_dict() for entry in _entries.values()]
+
+def _write_index(snapshot):
+    global _written_version
+    version, items = snapshot
+    with _write_lock:
+        if version <= _written_version:
+            return
+        os.makedirs(config.MEDIA_CACHE_DIR, exist_ok=True)
+        index_path = os.path.join(config.MEDIA_CACHE_DIR, INDEX_FILE)
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(items, f)
+        os.replace(temp_path, index_path)
+        _written_version = version
+
+def save_index():
+    if not _entries and not _dirty:
+        return
+    _write_index(_snapshot())
+
+def get_stats():
+    return {**stats, 'entries': len(_entries), 'bytes': _total_bytes}
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from collections import OrderedDict
+import config
+
+# ------------------------
+# Burst coalescing of same-author text messages
+# ------------------------
+# On routes with "coalesce": true in channels.json, a plain text message is
+# held for COALESCE_WINDOW seconds, and text messages the same author sends
+# to the same channel in that time are merged into it, so a burst of short
+# lines goes out as one message (one send, one header) instead of one each.
+# A burst is sent early when the next line would push it over the target
+# platform's length limit, when someone else writes, or when the author sends
+# something that can't be merged (a reply or media); flush() is awaited before
+# such messages so the order in the channel is kept.
+#
+# Held messages can still be edited (replace) or deleted (discard) before they
+# go out. Recently sent bursts are remembered per message ID so an edit or
+# delete of one line can re-render the merged message (see message_edits).
+
+# Message IDs of sent bursts remembered for edits/deletes
+DELIVERED_HISTORY = 1024
+
+class PendingBurst:
+    __slots__ = ('author_id', 'message_ids', 'messages', 'length', 'on_flush', 'timer')
+
+    def __init__(self, author_id, on_flush):
+        self.author_id = author_id
+        self.message_ids = []
+        self.messages = []
+        self.length = 0
+        self.on_flush = on_flush
+        self.timer = None
+
+_bursts = {}  # (platform, channel id) -> PendingBurst
+_delivered = OrderedDict()  # (platform, channel id, message id) -> PendingBurst
+_tasks = set()
+stats = {'messages': 0, 'bursts': 0, 'discarded': 0}
+
+def _take(key):
+    burst = _bursts.pop(key, None)
+    if burst is not None and burst.timer is not None:
+        burst.timer.cancel()
+    return burst
+
+def _send(key, burst):
+    stats['bursts'] += 1
+    if len(burst.messages) > 1:
+        for message_id in burst.message_ids:
+            _delivered[(*key, message_id)] = burst
+        while len(_delivered) > DELIVERED_HISTORY:
+            _delivered.popitem(last=False)
+    logging.debug("Sending burst of %s messages from %s", len(burst.messages), burst.author_id)
+    return burst.on_flush(list(burst.messages))
+
+def _expire(key):
+    burst = _take(key)
+    if burst is None:
+        return
+    task = asyncio.get_running_loop().create_task(_send(key, burst))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+def add(key, author_id, message_id, message, length, max_length, on_flush):
+    """
+    Buffers a text message of length characters. on_flush(messages) is a
+    coroutine function called once per burst with the messages in arrival
+    order; the callback given with the first message is the one used.
+    """
+    stats['messages'] += 1
+    burst = _bursts.get(key)
+    if burst is not None and (burst.author_id != author_id or burst.length + 1 + length > max_length):
+        _expire(key)
+        burst = None
+
+    if burst is None:
+        burst = _bursts[key] = PendingBurst(author_id, on_flush)
+        burst.timer = asyncio.get_running_loop().call_later(config.COALESCE_WINDOW, _expire, key)
+        burst.length = length
+    else:
+        burst.length += 1 + length  # joined with a newline
+    burst.message_ids.append(message_id)
+    burst.messages.append(message)
+
+async def flush(key):
+    # Sends the channel's pending burst now, before a message that can't join it
+    burst = _take(key)
+    if burst is not None:
+        await _send(key, burst)
+
+def replace(key, message_id, message):
+    # Swaps in the edited version of a held message; False if it isn't held
+    burst = _bursts.get(key)
+    if burst is None or message_id not in burst.message_ids:
+        return False
+    burst.messages[burst.message_ids.index(message_id)] = message
+    return True
+
+def discard(key, message_id):
+    # Drops a deleted message before it is sent; False if it isn't held
+    burst = _bursts.get(key)
+    if burst is None or message_id not in burst.message_ids:
+        return False
+    index = burst.message_ids.index(message_id)
+    del burst.message_ids[index]
+    del burst.messages[index]
+    stats['discarded'] += 1
+    if not burst.messages:
+        _take(key)
+    return True
+
+def update_delivered(key, message_id, message):
+    """
+    Swaps in the edited version of a message that went out merged with others;
+    False if it was sent on its own.
+    """
+    burst = _delivered.get((*key, message_id))
+    if burst is None:
+        return False
+    burst.messages[burst.message_ids.index(message_id)] = message
+    return True
+
+def get_delivered(key, message_id):
+    # The current messages of the burst a message went out in, or None if it was sent on its own
+    burst = _delivered.get((*key, message_id))
+    return list(burst.messages) if burst is not None else None
+
+def remove_delivered(key, message_id):
+    """
+    Removes a deleted message from the burst it went out in and returns the
+    remaining messages (empty when none are left), or None if it was sent on
+    its own.
+    """
+    burst = _delivered.pop((*key, message_id), None)
+    if burst is None:
+        return None
+    index = burst.message_ids.index(message_id)
+    del burst.message_ids[index]
+    del burst.messages[index]
+    return list(burst.messages)
+
+def get_stats():
+    return dict(stats)
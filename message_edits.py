@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import config
+
+# ------------------------
+# Debounced edit propagation
+# ------------------------
+# Edits are bridged through the message-ID mapping, but not one by one: each
+# edited message waits EDIT_DEBOUNCE seconds after its latest edit, so someone
+# fixing a typo five times in a row produces a single outbound edit with the
+# final text. Deleting the message drops its pending edit.
+
+class PendingEdit:
+    __slots__ = ('messages', 'on_edit', 'timer')
+
+    def __init__(self, messages, on_edit):
+        self.messages = messages
+        self.on_edit = on_edit
+        self.timer = None
+
+_edits = {}  # (platform, message id) -> PendingEdit
+_tasks = set()
+stats = {'received': 0, 'sent': 0, 'cancelled': 0}
+
+def _fire(key):
+    edit = _edits.pop(key, None)
+    if edit is None:
+        return
+    stats['sent'] += 1
+    task = asyncio.get_running_loop().create_task(edit.on_edit(edit.messages))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+def schedule(key, messages, on_edit):
+    """
+    Queues an edit. on_edit(messages) is a coroutine function called once the
+    message has had no new edit for EDIT_DEBOUNCE seconds; only the latest
+    messages and on_edit are used.
+    """
+    stats['received'] += 1
+    edit = _edits.get(key)
+    if edit is None:
+        edit = _edits[key] = PendingEdit(messages, on_edit)
+    else:
+        edit.timer.cancel()
+        edit.messages = messages
+        edit.on_edit = on_edit
+    edit.timer = asyncio.get_running_loop().call_later(config.EDIT_DEBOUNCE, _fire, key)
+    logging.debug("Edit of %s scheduled", key)
+
+def cancel(key):
+    edit = _edits.pop(key, None)
+    if edit is None:
+        return False
+    edit.timer.cancel()
+    stats['cancelled'] += 1
+    return True
+
+def get_stats():
+    return dict(stats)
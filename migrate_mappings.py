@@ -0,0 +1,93 @@
+import argparse
+import logging
+from pymongo import ASCENDING, UpdateOne
+import db
+import routes
+
+# ------------------------
+# Copy per-chat mapping collections into the consolidated collection
+# ------------------------
+# Safe to run while the bot is up: rows are upserted on (route, telegram_message_id, discord_message_id)
+# with $setOnInsert, so rows the bot already wrote are left alone, and progress
+# is checkpointed per collection so an interrupted run resumes where it stopped.
+#
+#   python migrate_mappings.py                 # every route in channels.json
+#   python migrate_mappings.py NU31 TEST       # only these collections
+#   python migrate_mappings.py --batch-size 5000 --restart
+
+MIGRATIONS_COLLECTION = 'mapping_migrations'
+
+def get_checkpoint(collection_name):
+    checkpoint = db.db[MIGRATIONS_COLLECTION].find_one({"_id": collection_name})
+    return checkpoint['last_id'] if checkpoint else None
+
+def set_checkpoint(collection_name, last_id, copied):
+    db.db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {"last_id": last_id}, "$inc": {"copied": copied}},
+        upsert=True
+    )
+
+def migrate_collection(collection_name, batch_size, restart=False):
+    source = db.db[collection_name]
+    target = db.db[db.MAPPINGS_COLLECTION]
+
+    if restart:
+        db.db[MIGRATIONS_COLLECTION].delete_one({"_id": collection_name})
+    last_id = get_checkpoint(collection_name)
+
+    total = 0
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(source.find(query).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for row in batch:
+            # Legacy rows have no timestamp; the ObjectId carries their insert time
+            created_at = row.get("created_at") or row["_id"].generation_time
+            document = db.build_mapping_document(
+                collection_name,
+                row["telegram_message_id"],
+                row["discord_message_id"],
+                kind=row.get("kind"),
+                source=row.get("source"),
+                created_at=created_at,
+            )
+            operations.append(UpdateOne(
+                {"route": collection_name, "telegram_message_id": row["telegram_message_id"], "discord_message_id": row["discord_message_id"]},
+                {"$setOnInsert": document},
+                upsert=True
+            ))
+
+        result = target.bulk_write(operations, ordered=False)
+        last_id = batch[-1]["_id"]
+        set_checkpoint(collection_name, last_id, result.upserted_count)
+        total += result.upserted_count
+        logging.info("Migrated %s: %s new rows in batch, %s total", collection_name, result.upserted_count, total)
+
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy per-chat mapping collections into the consolidated mapping collection.")
+    parser.add_argument("collections", nargs="*", help="collections to migrate (default: every db_collection in channels.json)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints and start from the beginning")
+    args = parser.parse_args()
+
+    # Console only: setup_logger() would truncate the running bot's logs/app.log
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db.ensure_mappings_collection()
+
+    collection_names = args.collections or sorted({route.collection_name for route in routes.all_routes() if route.collection_name})
+    existing = set(db.db.list_collection_names())
+    for collection_name in collection_names:
+        if collection_name not in existing:
+            logging.warning("Collection %s does not exist, skipping", collection_name)
+            continue
+        copied = migrate_collection(collection_name, args.batch_size, restart=args.restart)
+        logging.info("Finished %s: %s rows copied", collection_name, copied)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import json
+import signal
+import logging
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+CHANNELS_FILE = 'channels.json'
+WATCH_INTERVAL = 5  # seconds between mtime checks of channels.json
+
+# coalesce: merge bursts of text messages from one author (see message_bursts)
+Route = namedtuple('Route', ['telegram_channel_id', 'discord_channel_id', 'collection_name', 'coalesce'], defaults=(False,))
+
+# Frozen snapshot: (telegram_id -> Route, discord_id -> Route, collection -> Route, mtime).
+# Replaced as a whole on reload, so readers never see a half-built index.
+_index = (MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), None)
+_reload_lock = threading.Lock()
+_watcher = None
+
+# ------------------------
+# Loading
+# ------------------------
+
+def _build_index(channels_data):
+    by_telegram = {}
+    by_discord = {}
+    by_collection = {}
+    for item in channels_data['channels_mapping']:
+        route = Route(
+            telegram_channel_id=str(item['telegram_channel_id']),
+            discord_channel_id=str(item['discord_channel_id']),
+            collection_name=item.get('db_collection'),
+            coalesce=bool(item.get('coalesce', False)),
+        )
+        by_telegram[route.telegram_channel_id] = route
+        by_discord[route.discord_channel_id] = route
+        if route.collection_name:
+            by_collection[route.collection_name] = route
+    return MappingProxyType(by_telegram), MappingProxyType(by_discord), MappingProxyType(by_collection)
+
+def reload_routes(force=False):
+    """
+    Re-reads channels.json if its mtime changed (or force=True) and swaps the index.
+    On a parse error the previous index is kept.
+    """
+    global _index
+    file_path = os.path.abspath(CHANNELS_FILE)
+    with _reload_lock:
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+            if not force and mtime == _index[3]:
+                return False
+            with open(file_path, 'r', encoding='utf-8') as f:
+                channels_data = json.load(f)
+            by_telegram, by_discord, by_collection = _build_index(channels_data)
+        except Exception:
+            logging.error("Error loading JSON from %s", file_path, exc_info=True)
+            if _index[3] is None:
+                raise
+            return False
+
+        _index = (by_telegram, by_discord, by_collection, mtime)
+    logging.info("Loaded %s channel routes from %s", len(by_telegram), file_path)
+    return True
+
+# ------------------------
+# Lookups (no I/O)
+# ------------------------
+
+def get_route_by_telegram(telegram_channel_id):
+    return _index[0].get(str(telegram_channel_id))
+
+def get_route_by_discord(discord_channel_id):
+    return _index[1].get(str(discord_channel_id))
+
+def get_route_by_collection(collection_name):
+    return _index[2].get(collection_name)
+
+def all_routes():
+    return tuple(_index[0].values())
+
+# ------------------------
+# Hot reload
+# ------------------------
+
+def _watch_loop(stop_event, interval):
+    while not stop_event.wait(interval):
+        try:
+            reload_routes()
+        except Exception:
+            logging.error("Route reload failed", exc_info=True)
+
+def start_watcher(interval=WATCH_INTERVAL):
+    # Background thread polling channels.json mtime; lookups stay free of I/O
+    global _watcher
+    if _watcher is not None:
+        return _watcher
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_watch_loop, args=(stop_event, interval), name='routes-watcher', daemon=True)
+    thread.start()
+    _watcher = (thread, stop_event)
+    return _watcher
+
+def stop_watcher():
+    global _watcher
+    if _watcher is None:
+        return
+    _watcher[1].set()
+    _watcher = None
+
+def install_sighup_handler():
+    # SIGHUP forces a reload; must be called from the main thread
+    if not hasattr(signal, 'SIGHUP'):
+        return
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_routes, kwargs={'force': True}, daemon=True).start())
+
+reload_routes(force=True)
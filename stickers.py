@@ -0,0 +1,187 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+import transcoder
+
+# ------------------------
+# Animated and video sticker conversion
+# ------------------------
+# Telegram animated stickers (.tgs, gzipped Lottie) and video stickers (.webm,
+# VP9 with alpha) don't play in Discord, so they are rendered to STICKER_FORMAT
+# ("gif" or "webp"). .tgs files are rendered with rlottie-python in a worker
+# process, .webm files with ffmpeg. At most STICKER_WORKERS conversions run at
+# once and each may use STICKER_CPU_SECONDS of CPU time (enforced with RLIMIT_CPU
+# where available) and STICKER_TIMEOUT seconds of wall time, so a burst of
+# stickers can't starve message forwarding. Render workers are spawned rather
+# than forked from the threaded bot process, and a render that times out takes
+# its pool down with it so no worker keeps burning CPU on it. Results are
+# cached by file_unique_id through media_cache, so each sticker is converted once.
+
+ANIMATED_EXTENSIONS = {'.tgs', '.webm'}
+STICKER_FPS = 15
+
+try:
+    from rlottie_python import LottieAnimation
+except ImportError:
+    LottieAnimation = None
+    logging.info("rlottie-python not installed, animated .tgs stickers will be sent as text")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_pool = None
+_slots = None
+stats = {'converted': 0, 'failed': 0, 'timeouts': 0, 'unsupported': 0}
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=config.STICKER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _discard_pool(kill=False):
+    # Drops the current pool; with kill, its workers are stopped mid-render.
+    # Other renders running in it fail and are reported as failed.
+    global _pool
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    if kill:
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(config.STICKER_WORKERS)
+    return _slots
+
+def is_animated_sticker(ext):
+    return ext.lower() in ANIMATED_EXTENSIONS
+
+# ------------------------
+# Renderers
+# ------------------------
+
+def _limit_own_cpu_time(cpu_seconds):
+    # Runs in a (reused) worker process: the budget starts from what it has used so far
+    if resource is None or not cpu_seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + int(cpu_seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _render_tgs(tgs_path, output_path, size, fps, cpu_seconds):
+    # Runs in a worker process
+    _limit_own_cpu_time(cpu_seconds)
+    animation = LottieAnimation.from_tgs(tgs_path)
+    animation.save_animation(output_path, fps=fps, width=size, height=size)
+
+async def _convert_tgs(tgs_path, output_path):
+    if LottieAnimation is None:
+        stats['unsupported'] += 1
+        return False
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        _get_pool(), _render_tgs,
+        tgs_path, output_path, config.STICKER_SIZE, STICKER_FPS, config.STICKER_CPU_SECONDS,
+    )
+    try:
+        await asyncio.wait_for(future, config.STICKER_TIMEOUT)
+    except BrokenProcessPool:
+        # The worker went over its CPU budget and was killed; start a fresh pool
+        logging.warning("Sticker worker exceeded its CPU budget or was stopped on %s", tgs_path)
+        _discard_pool()
+        return False
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Cancelling the future doesn't stop a render that already started
+        _discard_pool(kill=True)
+        raise
+    return True
+
+async def _convert_webm(webm_path, output_path):
+    # libvpx-vp9 has to be forced as the decoder to keep the alpha channel
+    size = config.STICKER_SIZE
+    if config.STICKER_FORMAT == 'webp':
+        filters = f"fps={STICKER_FPS},scale={size}:-1:flags=lanczos"
+        output_args = ["-c:v", "libwebp_anim", "-lossless", "0", "-q:v", "70"]
+    else:
+        filters = (
+            f"fps={STICKER_FPS},scale={size}:-1:flags=lanczos,split[a][b];"
+            f"[a]palettegen=reserve_transparent=1[p];[b][p]paletteuse=alpha_threshold=128"
+        )
+        output_args = []
+
+    args = [
+        transcoder.FFMPEG_PATH, "-hide_banner", "-nostdin", "-y",
+        "-c:v", "libvpx-vp9", "-i", webm_path,
+        "-an", "-vf", filters, *output_args, "-loop", "0", output_path,
+    ]
+    returncode, _, stderr = await transcoder.run_process(args, config.STICKER_TIMEOUT, cpu_seconds=config.STICKER_CPU_SECONDS)
+    if returncode != 0:
+        logging.warning("ffmpeg failed to convert sticker %s: %s", webm_path, stderr.decode(errors='replace').strip()[-500:])
+        return False
+    return True
+
+# ------------------------
+# Public API
+# ------------------------
+
+async def convert_sticker(source_path, output_dir):
+    """
+    Renders an animated (.tgs) or video (.webm) sticker to STICKER_FORMAT in
+    output_dir. Returns the new path, or None if it can't be converted; the
+    caller removes source_path.
+    """
+    base, ext = os.path.splitext(os.path.basename(source_path))
+    output_path = os.path.join(output_dir, f"{base}.{config.STICKER_FORMAT}")
+
+    async with _get_slots():
+        try:
+            if ext.lower() == '.tgs':
+                converted = await _convert_tgs(source_path, output_path)
+            else:
+                converted = await _convert_webm(source_path, output_path)
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            logging.warning("Sticker conversion of %s timed out after %ss", source_path, config.STICKER_TIMEOUT)
+            converted = False
+        except asyncio.CancelledError:
+            _remove_quietly(output_path)
+            raise
+        except Exception:
+            logging.error("Error converting sticker %s", source_path, exc_info=True)
+            converted = False
+
+    if not converted or not os.path.exists(output_path):
+        stats['failed'] += 1
+        _remove_quietly(output_path)
+        return None
+
+    stats['converted'] += 1
+    return output_path
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+
+def get_stats():
+    return dict(stats)
@@ -0,0 +1,310 @@
+import os
+import gzip
+import json
+import time
+import logging
+import sqlite3
+import datetime
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+import config
+
+# ------------------------
+# Message-ID mapping storage backends
+# ------------------------
+# mapping_store talks to one of these through the same small interface.
+# STORAGE_BACKEND in config selects it: "mongo" (default), "sqlite" or "memory".
+# `blocking` tells mapping_store whether calls must go through its executor.
+
+class MappingStorage(ABC):
+    blocking = True
+
+    def ensure_collections(self, collection_names):
+        pass
+
+    def save_message(self, telegram_message_id, discord_message_id, collection_name, kind=None, source=None):
+        self.save_messages([(telegram_message_id, discord_message_id, kind, source)], collection_name)
+
+    @abstractmethod
+    def save_messages(self, mappings, collection_name):
+        # mappings: [(telegram_message_id, discord_message_id, kind, source), ...];
+        # source is the platform the original message was posted on
+        ...
+
+    @abstractmethod
+    def get_discord_message_id(self, telegram_message_id, collection_name):
+        ...
+
+    @abstractmethod
+    def get_telegram_message_id(self, discord_message_id, collection_name, source=None):
+        # With source, only rows recorded from that platform match
+        ...
+
+    @abstractmethod
+    def get_telegram_message_ids(self, discord_message_id, collection_name, source=None):
+        # Every row for the Discord message (one per attachment sent), oldest first
+        ...
+
+    def purge_expired(self, collection_names, cutoff, archive_dir=None):
+        # Delete (and optionally archive) mappings created before cutoff, a UTC datetime
+        return 0
+
+    def close(self):
+        pass
+
+def archive_rows(rows, collection_name, archive_dir):
+    # Write mapping rows to a new gzip-compressed JSONL file; returns the row count.
+    # The file is only created once there is at least one row.
+    f = None
+    file_path = None
+    count = 0
+    try:
+        for row in rows:
+            if f is None:
+                os.makedirs(archive_dir, exist_ok=True)
+                file_name = f"{collection_name}-{datetime.datetime.now(datetime.timezone.utc):%Y%m%d-%H%M%S-%f}.jsonl.gz"
+                file_path = os.path.join(archive_dir, file_name)
+                f = gzip.open(file_path, 'wt', encoding='utf-8')
+            f.write(json.dumps(row, default=str) + "\n")
+            count += 1
+    finally:
+        if f is not None:
+            f.close()
+    if count:
+        logging.info("Archived %s mappings from %s to %s", count, collection_name, file_path)
+    return count
+
+class MongoStorage(MappingStorage):
+    # Thin wrapper over db.py; importing db connects to Mongo, so it only
+    # happens when this backend is selected.
+    # MONGO_SCHEMA picks the layout: "consolidated" keeps every route in one
+    # collection, "per_chat" keeps the old collection-per-chat layout. While
+    # migrate_mappings.py hasn't finished, MAPPING_LEGACY_FALLBACK lets
+    # consolidated lookups fall back to the per-chat collection on a miss.
+    def __init__(self, schema=None):
+        import db
+        self.db = db
+        self.consolidated = (schema or config.MONGO_SCHEMA) == 'consolidated'
+        self.legacy_fallback = self.consolidated and config.MAPPING_LEGACY_FALLBACK
+
+    def ensure_collections(self, collection_names):
+        if self.consolidated:
+            self.db.ensure_mappings_collection()
+        if not self.consolidated or self.legacy_fallback:
+            self.db.ensure_collections(collection_names)
+
+    def save_message(self, telegram_message_id, discord_message_id, collection_name, kind=None, source=None):
+        if self.consolidated:
+            self.db.save_mappings([(telegram_message_id, discord_message_id, kind, source)], route_name=collection_name)
+        else:
+            self.db.save_message_to_db(telegram_message_id=telegram_message_id, discord_message_id=discord_message_id, collection_name=collection_name, kind=kind, source=source)
+
+    def save_messages(self, mappings, collection_name):
+        if self.consolidated:
+            self.db.save_mappings(mappings, route_name=collection_name)
+        else:
+            self.db.save_messages_to_db(mappings, collection_name=collection_name)
+
+    def get_discord_message_id(self, telegram_message_id, collection_name):
+        if self.consolidated:
+            result = self.db.find_discord_message_id(telegram_message_id=telegram_message_id, route_name=collection_name)
+            if result is not None or not self.legacy_fallback:
+                return result
+        return self.db.get_discord_message_id(telegram_message_id=telegram_message_id, collection_name=collection_name)
+
+    def get_telegram_message_id(self, discord_message_id, collection_name, source=None):
+        if self.consolidated:
+            result = self.db.find_telegram_message_id(discord_message_id=discord_message_id, route_name=collection_name, source=source)
+            if result is not None or not self.legacy_fallback:
+                return result
+        return self.db.get_telegram_message_id(discord_message_id=discord_message_id, collection_name=collection_name, source=source)
+
+    def get_telegram_message_ids(self, discord_message_id, collection_name, source=None):
+        if self.consolidated:
+            result = self.db.find_telegram_message_ids(discord_message_id=discord_message_id, route_name=collection_name, source=source)
+            if result or not self.legacy_fallback:
+                return result
+        return self.db.get_telegram_message_ids(discord_message_id=discord_message_id, collection_name=collection_name, source=source)
+
+    def purge_expired(self, collection_names, cutoff, archive_dir=None):
+        # Without archiving the TTL index does the work on the server
+        if not archive_dir:
+            return 0
+        deleted = 0
+        for collection_name in collection_names:
+            if self.consolidated:
+                archive_rows(self.db.find_expired_mappings(collection_name, cutoff), collection_name, archive_dir)
+                deleted += self.db.delete_expired_mappings(collection_name, cutoff)
+            else:
+                archive_rows(self.db.find_expired(collection_name, cutoff), collection_name, archive_dir)
+                deleted += self.db.delete_expired(collection_name, cutoff)
+        return deleted
+
+    def close(self):
+        self.db.mongo_client.close()
+
+class SQLiteStorage(MappingStorage):
+    # Embedded single-file store in WAL mode. All collections share one table
+    # keyed by collection name; lookups hit the composite indexes below.
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "collection TEXT NOT NULL, "
+            "telegram_message_id INTEGER NOT NULL, "
+            "discord_message_id INTEGER NOT NULL, "
+            "created_at INTEGER, "
+            "source TEXT)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if 'created_at' not in columns:
+            self.conn.execute("ALTER TABLE messages ADD COLUMN created_at INTEGER")
+        if 'source' not in columns:
+            self.conn.execute("ALTER TABLE messages ADD COLUMN source TEXT")
+        # One row per (telegram, discord) pair: a coalesced Discord burst maps several
+        # Discord messages to one Telegram message, so the Telegram side isn't unique
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS messages_pair ON messages (collection, telegram_message_id, discord_message_id)")
+        self.conn.execute("DROP INDEX IF EXISTS messages_telegram")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_discord ON messages (collection, discord_message_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at)")
+        logging.info("Using SQLite mapping storage at %s", path)
+
+    def save_messages(self, mappings, collection_name):
+        if not mappings:
+            return
+        created_at = int(time.time())
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO messages (collection, telegram_message_id, discord_message_id, created_at, source) VALUES (?, ?, ?, ?, ?)",
+                    [(collection_name, telegram_message_id, discord_message_id, created_at, source) for telegram_message_id, discord_message_id, _, source in mappings],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                # Autocommit mode: a failed batch would otherwise leave the transaction open and break every later BEGIN
+                self.conn.execute("ROLLBACK")
+                logging.error("Error saving %s messages to database", len(mappings), exc_info=True)
+
+    def _fetch_one(self, query, params):
+        with self.lock:
+            row = self.conn.execute(query, params).fetchone()
+        return row[0] if row else None
+
+    def get_discord_message_id(self, telegram_message_id, collection_name):
+        return self._fetch_one(
+            "SELECT discord_message_id FROM messages WHERE collection = ? AND telegram_message_id = ? LIMIT 1",
+            (collection_name, telegram_message_id),
+        )
+
+    def get_telegram_message_id(self, discord_message_id, collection_name, source=None):
+        if source is not None:
+            return self._fetch_one(
+                "SELECT telegram_message_id FROM messages WHERE collection = ? AND discord_message_id = ? AND source = ? ORDER BY rowid LIMIT 1",
+                (collection_name, discord_message_id, source),
+            )
+        return self._fetch_one(
+            "SELECT telegram_message_id FROM messages WHERE collection = ? AND discord_message_id = ? ORDER BY rowid LIMIT 1",
+            (collection_name, discord_message_id),
+        )
+
+    def get_telegram_message_ids(self, discord_message_id, collection_name, source=None):
+        query = "SELECT telegram_message_id FROM messages WHERE collection = ? AND discord_message_id = ?"
+        params = (collection_name, discord_message_id)
+        if source is not None:
+            query += " AND source = ?"
+            params += (source,)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+        return [row[0] for row in rows]
+
+    def purge_expired(self, collection_names, cutoff, archive_dir=None):
+        # SQLite has no TTL indexes, so expiry is a periodic range delete on created_at
+        cutoff_ts = int(cutoff.timestamp())
+        deleted = 0
+        for collection_name in collection_names:
+            with self.lock:
+                if archive_dir:
+                    rows = self.conn.execute(
+                        "SELECT telegram_message_id, discord_message_id, created_at, source FROM messages WHERE collection = ? AND created_at < ?",
+                        (collection_name, cutoff_ts),
+                    ).fetchall()
+                    archive_rows(
+                        ({"telegram_message_id": t, "discord_message_id": d, "created_at": datetime.datetime.fromtimestamp(c, datetime.timezone.utc), "source": s} for t, d, c, s in rows),
+                        collection_name, archive_dir,
+                    )
+                cursor = self.conn.execute("DELETE FROM messages WHERE collection = ? AND created_at < ?", (collection_name, cutoff_ts))
+                deleted += cursor.rowcount
+        return deleted
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class MemoryStorage(MappingStorage):
+    # Process-local dicts; mappings are lost on restart. Meant for tests and
+    # throwaway deployments.
+    blocking = False
+
+    def __init__(self):
+        self.by_telegram = {}
+        self.by_discord = {}
+        # Insertion order is creation order, so expiry pops from the left
+        self.created = deque()
+
+    def save_messages(self, mappings, collection_name):
+        by_telegram = self.by_telegram.setdefault(collection_name, {})
+        by_discord = self.by_discord.setdefault(collection_name, {})
+        created_at = time.time()
+        for telegram_message_id, discord_message_id, _, source in mappings:
+            by_telegram.setdefault(telegram_message_id, discord_message_id)
+            rows = by_discord.setdefault(discord_message_id, [])
+            if all(row[0] != telegram_message_id for row in rows):
+                rows.append((telegram_message_id, source))
+            self.created.append((created_at, collection_name, telegram_message_id, discord_message_id))
+
+    def get_discord_message_id(self, telegram_message_id, collection_name):
+        return self.by_telegram.get(collection_name, {}).get(telegram_message_id)
+
+    def get_telegram_message_id(self, discord_message_id, collection_name, source=None):
+        telegram_message_ids = self.get_telegram_message_ids(discord_message_id, collection_name, source)
+        return telegram_message_ids[0] if telegram_message_ids else None
+
+    def get_telegram_message_ids(self, discord_message_id, collection_name, source=None):
+        rows = self.by_discord.get(collection_name, {}).get(discord_message_id, ())
+        return [telegram_message_id for telegram_message_id, row_source in rows if source is None or row_source == source]
+
+    def purge_expired(self, collection_names, cutoff, archive_dir=None):
+        # Non-persistent store: expired rows are dropped, never archived
+        cutoff_ts = cutoff.timestamp()
+        deleted = 0
+        while self.created and self.created[0][0] < cutoff_ts:
+            _, collection_name, telegram_message_id, discord_message_id = self.created.popleft()
+            by_telegram = self.by_telegram.get(collection_name, {})
+            by_discord = self.by_discord.get(collection_name, {})
+            if by_telegram.get(telegram_message_id) == discord_message_id:
+                del by_telegram[telegram_message_id]
+            rows = [row for row in by_discord.get(discord_message_id, ()) if row[0] != telegram_message_id]
+            if rows:
+                by_discord[discord_message_id] = rows
+            else:
+                by_discord.pop(discord_message_id, None)
+            deleted += 1
+        return deleted
+
+def create_storage(backend=None):
+    backend = (backend or config.STORAGE_BACKEND).lower()
+    if backend == 'mongo':
+        return MongoStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(config.SQLITE_PATH)
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
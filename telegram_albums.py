@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import config
+
+# ------------------------
+# Telegram album (media_group_id) aggregation
+# ------------------------
+# Telegram delivers an album as one update per item, all sharing a
+# media_group_id. Items are buffered per (chat, media_group_id) until no new
+# item arrived for ALBUM_WINDOW seconds, or the album hit Telegram's 10-item
+# limit, and then handed to the callback as one ordered list.
+
+MAX_ALBUM_SIZE = 10
+
+class PendingAlbum:
+    __slots__ = ('messages', 'on_complete', 'timer')
+
+    def __init__(self, on_complete):
+        self.messages = []
+        self.on_complete = on_complete
+        self.timer = None
+
+_albums = {}
+_tasks = set()
+
+def _complete(key):
+    album = _albums.pop(key, None)
+    if album is None:
+        return
+    if album.timer is not None:
+        album.timer.cancel()
+    messages = sorted(album.messages, key=lambda m: m.message_id)
+    logging.debug("Album %s complete with %s items", key[1], len(messages))
+    task = asyncio.get_running_loop().create_task(album.on_complete(messages))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+def add(message, on_complete):
+    """
+    Buffers an album item. on_complete(messages) is a coroutine function called
+    once per album; the callback given with the first item is the one used.
+    """
+    key = (message.chat.id, message.media_group_id)
+    album = _albums.get(key)
+    if album is None:
+        album = _albums[key] = PendingAlbum(on_complete)
+    album.messages.append(message)
+
+    if album.timer is not None:
+        album.timer.cancel()
+    if len(album.messages) >= MAX_ALBUM_SIZE:
+        _complete(key)
+    else:
+        album.timer = asyncio.get_running_loop().call_later(config.ALBUM_WINDOW, _complete, key)
@@ -1,44 +1,31 @@
-import telebot
-import os
+from telebot.async_telebot import AsyncTeleBot
 import asyncio
 import logging
-import random
-import emoji
 from dotenv import load_dotenv
-import db
-import json
+import routes
 import config
-import datetime
+import bridge
 import telegram_media
+import telegram_albums
+import message_bursts
+import message_edits
+import discord_webhooks
 import discord
 
 load_dotenv()
 
-tg_bot = telebot.TeleBot(config.TELEGRAM_TOKEN)
-config.TELEGRAM_BOT_ID = tg_bot.get_me().id
-logging.debug(f'Telegram bot ID: {config.TELEGRAM_BOT_ID}')
-
-discord_loop = None
-
-# ------------------------
-# Global discord_loop variable initialization and polling
-# ------------------------
-
-def set_discord_loop(loop):
-    global discord_loop
-    discord_loop = loop
+# Async client: Telegram polling, handlers and sends all run on the same
+# event loop as the Discord client
+tg_bot = AsyncTeleBot(config.TELEGRAM_TOKEN)
 
-def log_event(level, event, **fields):
-    payload = {"event": event, **fields}
-    message = json.dumps(payload, indent=2, ensure_ascii=False, default=str)
-    logging.log(level, message)
+DISCORD_MESSAGE_LIMIT = 2000
 
 def log_incoming(message, has_media: bool):
     if not message or not message.from_user:
         return
     if message.from_user.is_bot or message.from_user.id == config.TELEGRAM_BOT_ID:
         return
-    log_event(
+    bridge.log_event(
         logging.INFO,
         "incoming_telegram",
         channel_id=message.chat.id,
@@ -47,304 +34,245 @@ def log_incoming(message, has_media: bool):
         reply=bool(message.reply_to_message),
         media=has_media,
     )
-
-def log_sent_to_discord(telegram_message_id, discord_message_id, discord_channel_id, collection_name, kind):
-    log_event(
-        logging.INFO,
-        "sent_discord",
-        channel_id=discord_channel_id,
-        tg_msg_id=telegram_message_id,
-        dc_msg_id=discord_message_id,
-        collection=collection_name,
-        kind=kind,
-    )
 
-def run_telegram():
+# ------------------------
+# Startup and polling
+# ------------------------
+
+async def connect_telegram():
+    me = await tg_bot.get_me()
+    config.TELEGRAM_BOT_ID = me.id
+    logging.info("Telegram bot connected as %s (id=%s)", me.username or me.first_name, me.id)
+
+async def run_telegram():
+    # Long polling; used unless TELEGRAM_MODE is "webhook" (or as its fallback)
     try:
-        me = tg_bot.get_me()
-        logging.info("Telegram bot connected as %s (id=%s)", me.username or me.first_name, me.id)
+        await tg_bot.delete_webhook()
     except Exception:
-        logging.error("Telegram bot connection check failed", exc_info=True)
+        logging.warning("Failed to delete Telegram webhook before polling", exc_info=True)
     while True:
         try:
-            tg_bot.infinity_polling(long_polling_timeout=30, timeout=60)
+            await tg_bot.infinity_polling(timeout=30, request_timeout=60)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logging.error("Telegram polling error", exc_info=True)
-            import time
-            time.sleep(5)
+            await asyncio.sleep(5)
 
 # ------------------------
 # Telegram bot handlers
 # ------------------------
 
 @tg_bot.message_handler(commands=['start', 'help'])
-def send_welcome(message):
+async def send_welcome(message):
     text = config.WELCOME_MESSAGE
-    tg_bot.reply_to(message, text)
+    await tg_bot.reply_to(message, text)
     logging.debug("Sent welcome message to Telegram user %s", message.from_user.first_name)
 
 @tg_bot.message_handler(content_types=['text'])
-def handle_text_from_group(message):
+async def handle_text_from_group(message):
     if message.chat.type not in ['group', 'supergroup']:
         return
     log_incoming(message, has_media=False)
-    try:
-        discord_channel, collection_name = get_discord_channel_and_collection(message)
-    except Exception as e:
-        logging.warning("Failed to resolve Discord channel/collection for Telegram message: %s", e)
+    route = get_route(message)
+    if not route:
         return
-   
-    if message.reply_to_message:
-        discord_loop.call_soon_threadsafe(
-            asyncio.create_task, 
-            send_message_to_discord_reply(message, discord_channel, collection_name))
-    else:
-        discord_loop.call_soon_threadsafe(
-            asyncio.create_task, 
-            send_message_to_discord(message, discord_channel, collection_name))
+
+    burst_key = get_burst_key(message)
+    if route.coalesce and not message.reply_to_message:
+        # Held briefly so following lines from the same user go out as one Discord message
+        message_bursts.add(
+            burst_key, message.from_user.id, message.message_id, message, len(message.text),
+            DISCORD_MESSAGE_LIMIT - len(get_user_name(message)) - 16,  # room for the emoji + name header
+            lambda messages: relay_to_discord(messages, route),
+        )
+        return
+    await message_bursts.flush(burst_key)
+    await relay_to_discord([message], route)
 
 @tg_bot.message_handler(content_types=['photo', 'video', 'document', 'audio', 'voice'])
-def handle_media_from_group(message):
+async def handle_media_from_group(message):
     if message.chat.type not in ['group', 'supergroup']:
         return
     log_incoming(message, has_media=True)
-    try:
-        discord_channel, collection_name = get_discord_channel_and_collection(message)
-    except Exception as e:
-        logging.warning("Failed to resolve Discord channel/collection for Telegram message: %s", e)
+    route = get_route(message)
+    if not route:
+        return
+    await message_bursts.flush(get_burst_key(message))
+
+    if message.media_group_id:
+        # Album item: buffered and sent together with the rest of the album
+        telegram_albums.add(message, lambda messages: send_album_to_discord(messages, route))
         return
 
     try:
-        media_files = telegram_media.get_media_files(message, tg_bot)
+        media_files = await telegram_media.get_media_files(message, tg_bot)
     except ValueError as e:
         logging.warning("Media extraction failed: %s", e)
 
         message.text = 'Error download media files from Telegram'
-        discord_loop.call_soon_threadsafe(
-            asyncio.create_task, 
-            send_message_to_discord(message, discord_channel, collection_name))
+        await relay_to_discord([message], route)
         return
 
     if media_files:
-        if message.reply_to_message:
-            discord_loop.call_soon_threadsafe(
-            asyncio.create_task,
-            send_media_to_discord_reply(message, discord_channel, collection_name, media_files))
-        else:
-            discord_loop.call_soon_threadsafe(
-                asyncio.create_task,
-                send_media_to_discord(message, discord_channel, collection_name, media_files))
+        await relay_to_discord([message], route, media_files=media_files)
     else:
         logging.debug("No media files to send")
 
 @tg_bot.message_handler(content_types=['sticker'])
-def handle_sticker(message):
+async def handle_sticker(message):
     if message.chat.type not in ['group', 'supergroup']:
         return
     log_incoming(message, has_media=True)
-    try:
-        discord_channel, collection_name = get_discord_channel_and_collection(message)
-    except Exception as e:
-        logging.warning("Failed to resolve Discord channel/collection for Telegram message: %s", e)
+    route = get_route(message)
+    if not route:
         return
-    
+    await message_bursts.flush(get_burst_key(message))
+
     sticker = message.sticker
     if sticker.is_animated:
-        logging.debug("Animated sticker detected")
-
-        message.text = 'There is an animated sticker in telegram message'
-
-        discord_loop.call_soon_threadsafe(
-            asyncio.create_task, 
-            send_message_to_discord(message, discord_channel, collection_name, media_files=None))
-        return
-
+        logging.debug("Animated sticker (.tgs) detected")
     elif sticker.is_video:
         logging.debug("Video sticker (.webm) detected")
-
-        message.text = 'There is an animated sticker in telegram message'
-
-        discord_loop.call_soon_threadsafe(
-            asyncio.create_task, 
-            send_message_to_discord(message, discord_channel, collection_name, media_files=None))
-        return
-    
     else:
         logging.debug("Static sticker (.webp) detected")
-        try:
-            media_files = telegram_media.get_media_files(message, tg_bot)
-        except ValueError as e:
-            logging.warning("Media extraction failed: %s", e)
-            return
-        
-        if media_files:
-            if message.reply_to_message:
-                discord_loop.call_soon_threadsafe(
-                asyncio.create_task,
-                send_media_to_discord_reply(message, discord_channel, collection_name, media_files))
-            else:
-                discord_loop.call_soon_threadsafe(
-                    asyncio.create_task,
-                    send_media_to_discord(message, discord_channel, collection_name, media_files))
+
+    # Animated and video stickers are converted to GIF/WebP (cached per sticker)
+    try:
+        media_files = [file_path for file_path in await telegram_media.get_media_files(message, tg_bot) if file_path]
+    except ValueError as e:
+        logging.warning("Media extraction failed: %s", e)
+        return
+
+    if not media_files:
+        if sticker.is_animated or sticker.is_video:
+            message.text = 'There is an animated sticker in telegram message'
+            await relay_to_discord([message], route)
         else:
             logging.debug("No media files to send")
-
-# ------------------------
-# Functions to send messages to Discord
-# ------------------------
-
-async def send_message_to_discord_reply(message, discord_channel, collection_name):
-    from discord_bot import discord_client
-
-    user_data = get_telegram_user_data(message)
-    reply_to_message_id = message.reply_to_message.message_id
-
-    original_discord_message_id = db.get_discord_message_id(telegram_message_id=reply_to_message_id, collection_name=collection_name)
+        return
 
-    if original_discord_message_id:
-        channel = await discord_client.fetch_channel(discord_channel)
-        
-        try:
-            original_discord_message = await channel.fetch_message(original_discord_message_id)
-        
-            if original_discord_message:
-                update_last_message_user_id()
-                if not check_last_message_user_id(current_user_id=str(user_data['user_id']), telegram_channel_id=str(user_data['channel_id']), discord_channel_id=discord_channel):
-                    avatar_emoji = emoji.emojize(random.choice(config.AVATAR_EMOJIS))
-                    text = f"{avatar_emoji} **{user_data['user_name']}**\n{user_data['text']}"
-                else:
-                    text = user_data['text']
+    await relay_to_discord([message], route, media_files=media_files)
 
-                set_last_message_user_id(user_name=user_data['user_name'], user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
+@tg_bot.edited_message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice'])
+async def handle_edit_from_group(message):
+    if message.chat.type not in ['group', 'supergroup']:
+        return
+    route = get_route(message)
+    if not route:
+        return
 
-                discord_message = await original_discord_message.reply(text)
-                discord_message_id = discord_message.id
+    burst_key = get_burst_key(message)
+    if message_bursts.replace(burst_key, message.message_id, message):
+        # Not sent yet: the burst goes out with the new text
+        return
+    message_bursts.update_delivered(burst_key, message.message_id, message)
 
-                db.save_message_to_db(telegram_message_id=user_data['message_id'], discord_message_id=discord_message_id, collection_name=collection_name)
-                log_sent_to_discord(
-                    telegram_message_id=user_data['message_id'],
-                    discord_message_id=discord_message_id,
-                    discord_channel_id=discord_channel,
-                    collection_name=collection_name,
-                    kind="reply",
-                )
+    async def on_edit(edited):
+        # A line of a burst re-renders the whole merged message from its current lines
+        messages = message_bursts.get_delivered(burst_key, message.message_id) or edited
+        await bridge.relay_edit(normalize(messages, route), DISCORD)
 
-        except Exception as e:
-            logging.error("Error sending reply message to Discord", exc_info=True)
-    else:
-        await send_message_to_discord(message, discord_channel, collection_name)
-
-async def send_message_to_discord(message, discord_channel, collection_name):
-    from discord_bot import discord_client
-    
-    user_data = get_telegram_user_data(message)
-    channel = await discord_client.fetch_channel(discord_channel)
-
-    if channel:
-        update_last_message_user_id()
-        if not check_last_message_user_id(current_user_id=str(user_data['user_id']), telegram_channel_id=str(user_data['channel_id']), discord_channel_id=discord_channel):
-            avatar_emoji = emoji.emojize(random.choice(config.AVATAR_EMOJIS))
-            text = f"{avatar_emoji} **{user_data['user_name']}**\n{user_data['text']}"
-        else:
-            text = user_data['text']
-
-        set_last_message_user_id(user_name=user_data['user_name'], user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
-
-        discord_message = await channel.send(text)
-        discord_message_id = discord_message.id
+    message_edits.schedule(('telegram', message.message_id), [message], on_edit)
 
-        db.save_message_to_db(telegram_message_id=user_data['message_id'], discord_message_id=discord_message_id, collection_name=collection_name)
-        log_sent_to_discord(
-            telegram_message_id=user_data['message_id'],
-            discord_message_id=discord_message_id,
-            discord_channel_id=discord_channel,
-            collection_name=collection_name,
-            kind="text",
-        )
-
 # ------------------------
-# Functions to send media files to Discord
+# Telegram -> Discord adapter
 # ------------------------
 
-async def send_media_to_discord(message, discord_channel, collection_name, media_files=None):
-    from discord_bot import discord_client
-
-    user_data = get_telegram_user_data(message)
-    channel = await discord_client.fetch_channel(discord_channel)
-    files = get_files(media_files)
-
-    if channel:
-        update_last_message_user_id()
-        if not check_last_message_user_id(current_user_id=str(user_data['user_id']), telegram_channel_id=str(user_data['channel_id']), discord_channel_id=discord_channel):
-            avatar_emoji = emoji.emojize(random.choice(config.AVATAR_EMOJIS))
-            if user_data['caption']:
-                text = f"{avatar_emoji} **{user_data['user_name']}**\n{user_data['caption']}"
-            else:
-                text = f"{avatar_emoji} **{user_data['user_name']}**"
-        else:
-            text = user_data['caption']
-
-        set_last_message_user_id(user_name=user_data['user_name'], user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
-
-        discord_message = await channel.send(content=text, files=files)
-        discord_message_id = discord_message.id
+def normalize(messages, route, media_files=None):
+    """
+    Builds the BridgeMessage for one Telegram message, or for several sent as
+    one (an album or a burst of text): the first one's author and reply, the
+    texts/captions joined, every message ID mapped.
+    """
+    first_message = messages[0]
+    return bridge.BridgeMessage(
+        'telegram', route, first_message.message_id,
+        author_id=first_message.from_user.id,
+        author_name=get_user_name(first_message),
+        text='\n'.join(text for text in (message.text or message.caption for message in messages) if text),
+        reply_to_id=first_message.reply_to_message.message_id if first_message.reply_to_message else None,
+        media=media_files,
+        raw=first_message,
+        parts=messages,
+        source_ids=tuple(message.message_id for message in messages),
+    )
 
-        telegram_media.clean_media_files(media_files)
-        db.save_message_to_db(telegram_message_id=user_data['message_id'], discord_message_id=discord_message_id, collection_name=collection_name)
-        log_sent_to_discord(
-            telegram_message_id=user_data['message_id'],
-            discord_message_id=discord_message_id,
-            discord_channel_id=discord_channel,
-            collection_name=collection_name,
-            kind="media",
-        )
-
-async def send_media_to_discord_reply(message, discord_channel, collection_name, media_files=None):
-    from discord_bot import discord_client
+async def relay_to_discord(messages, route, media_files=None):
+    await bridge.relay(normalize(messages, route, media_files=media_files), DISCORD)
 
-    user_data = get_telegram_user_data(message)
-    reply_to_message_id = message.reply_to_message.message_id
+async def send_album_to_discord(messages, route):
+    # All album items go out as one Discord message; every Telegram message ID maps to it
+    results = await asyncio.gather(
+        *(telegram_media.get_media_files(message, tg_bot) for message in messages),
+        return_exceptions=True
+    )
 
-    original_discord_message_id = db.get_discord_message_id(telegram_message_id=reply_to_message_id, collection_name=collection_name)
-    
-    files = get_files(media_files)
-
-    if original_discord_message_id:
-        channel = await discord_client.fetch_channel(discord_channel)
-        
+    media_files = []
+    for message, result in zip(messages, results):
+        if isinstance(result, Exception):
+            logging.warning("Media extraction failed for album item %s: %s", message.message_id, result)
+            continue
+        media_files.extend(file_path for file_path in result if file_path)
+
+    if not media_files:
+        messages[0].text = 'Error download media files from Telegram'
+        await relay_to_discord(messages[:1], route)
+        return
+
+    # The album caption sits on one of the items (usually the first); normalize picks it up
+    await relay_to_discord(messages, route, media_files=media_files)
+
+class DiscordAdapter:
+    __slots__ = ()
+
+    def kind(self, message, replying):
+        if message.media:
+            return "reply_media" if replying else "media"
+        return "reply" if replying else "text"
+
+    def format(self, message, header):
+        # With the bot account, the author is shown as an emoji + name header
+        if not header:
+            return message.text
+        header_line = f"{bridge.avatar_emoji()} **{message.author_name}**"
+        return f"{header_line}\n{message.text}" if message.text else header_line
+
+    async def deliver(self, message, header, reply_to):
+        """
+        Posts through the webhook pool with the author's name as the username
+        when webhook delivery is on, otherwise as the bot under a header.
+        reply_to is the Discord message ID being replied to.
+        """
+        from discord_bot import get_discord_channel
+
+        files = get_files(message.media)
         try:
-            original_discord_message = await channel.fetch_message(original_discord_message_id)
-        
-            if original_discord_message:
-                update_last_message_user_id()
-                if not check_last_message_user_id(current_user_id=str(user_data['user_id']), telegram_channel_id=str(user_data['channel_id']), discord_channel_id=discord_channel):
-                    avatar_emoji = emoji.emojize(random.choice(config.AVATAR_EMOJIS))
-                    if user_data['caption']:
-                        text = f"{avatar_emoji} **{user_data['user_name']}**\n{user_data['caption']}"
-                    else:
-                        text = f"{avatar_emoji} **{user_data['user_name']}**"
-                else:
-                    text = user_data['caption']
-
-                set_last_message_user_id(user_name=user_data['user_name'], user_id=str(user_data['user_id']), channel_id=str(user_data['channel_id']))
-
-                discord_message = await original_discord_message.reply(content=text, files=files)
-                discord_message_id = discord_message.id
+            channel = await get_discord_channel(message.route.discord_channel_id)
+            discord_message = None
+            if discord_webhooks.enabled():
+                discord_message = await discord_webhooks.send(channel, message.text, message.author_name, files=files, reply_to=reply_to)
+                if discord_message is None and files:
+                    # A failed webhook send has already closed the files
+                    files = get_files(message.media)
+            if discord_message is None:
+                reference = get_reply_reference(channel, reply_to) if reply_to else None
+                discord_message = await channel.send(content=self.format(message, header), files=files, reference=reference)
+        finally:
+            if message.media:
+                telegram_media.clean_media_files(message.media)
+        return [discord_message.id]
+
+    async def edit(self, message, target_id, reply_to):
+        from discord_bot import get_discord_channel
 
-                telegram_media.clean_media_files(media_files)
-                db.save_message_to_db(telegram_message_id=user_data['message_id'], discord_message_id=discord_message_id, collection_name=collection_name)
-                log_sent_to_discord(
-                    telegram_message_id=user_data['message_id'],
-                    discord_message_id=discord_message_id,
-                    discord_channel_id=discord_channel,
-                    collection_name=collection_name,
-                    kind="reply_media",
-                )
+        channel = await get_discord_channel(message.route.discord_channel_id)
+        if discord_webhooks.enabled() and await discord_webhooks.edit(channel, target_id, message.text, reply_to=reply_to):
+            return
+        # The edit stands on its own, so it always carries the header
+        await channel.get_partial_message(int(target_id)).edit(content=self.format(message, header=True))
 
-        except Exception as e:
-            logging.error("Error sending reply media to Discord", exc_info=True)
-    else:
-        await send_media_to_discord(message, discord_channel, collection_name, media_files=media_files)
+DISCORD = DiscordAdapter()
 
 # ------------------------
 
@@ -359,106 +287,27 @@ def get_files(media_files):
         return files
     else:
         return None
+
+def get_reply_reference(channel, discord_message_id):
+    # Built from the mapped ID, so replying costs no fetch_message round trip; if the
+    # target was deleted, Discord sends the message without the reply instead of failing
+    return channel.get_partial_message(int(discord_message_id)).to_reference(fail_if_not_exists=False)
 
-def get_discord_channel_and_collection(message):
-    try:
-        channels_mapping = load_channels_mapping()
-    except Exception as e:
-        logging.error("Error loading channels mapping", exc_info=True)
-        raise
-
-    discord_channel = str(channels_mapping.get(str(message.chat.id)))
-    if not discord_channel:
-        error_msg = f"Discord channel not found for Telegram channel {message.chat.id} named {message.chat.title}"
-        logging.warning(error_msg)
-        raise ValueError(error_msg)
-
-    collection_name = get_collection_name(str(message.chat.id))
-    if not collection_name:
-        error_msg = f"Collection not found for Telegram channel {message.chat.id} named {message.chat.title}"
-        logging.warning(error_msg)
-        raise ValueError(error_msg)
-
-    return discord_channel, collection_name
-
-def get_telegram_user_data(message):
-    if message:
-        user_name = f'{message.from_user.first_name} {message.from_user.last_name}' if message.from_user.last_name else message.from_user.first_name
-        user_id = message.from_user.id
-        message_id = message.message_id
-        text = message.text
-        channel_id = message.chat.id
-        channel_name = message.chat.title
-        caption = message.caption
-
-    return {
-        'user_name': user_name, 
-        'user_id': user_id,
-        'message_id': message_id,
-        'text': text,
-        'channel_id': channel_id,
-        'channel_name': channel_name,
-        'caption': caption
-    }
-
-def load_channels_mapping():
-# Function to load the channels mapping from the JSON file
-    try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        telegram_to_discord = {item['telegram_channel_id']: item['discord_channel_id'] for item in channels_data['channels_mapping']}
-        return telegram_to_discord
-    except Exception as e:
-        logging.error("Error loading JSON from %s", file_path, exc_info=True)
-        raise
-
-def get_collection_name(telegram_channel_id):
-# Function to get the collection name based on the Telegram channel ID
-    try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        collection_mapping = {item['telegram_channel_id']: item['db_collection'] for item in channels_data['channels_mapping']}
-        collection_name = collection_mapping.get(telegram_channel_id)
-        return collection_name
-    except Exception as e:
-        logging.error("Error loading JSON from %s", file_path, exc_info=True)
-        raise
-    
-# ------------------------
-# Functions to check and set last message user ID
-# ------------------------
-
-def check_last_message_user_id(current_user_id:str, telegram_channel_id:str, discord_channel_id:str):
-    # Function to check if the last message user ID is the same as the current user ID
+def get_burst_key(message):
+    return ('telegram', message.chat.id)
 
-    if telegram_channel_id in config.TELEGRAM_CHANNEL_LAST_USER:
-        telegram_channel_last_user_id = config.TELEGRAM_CHANNEL_LAST_USER[telegram_channel_id]['user_id']
-        if telegram_channel_last_user_id == current_user_id:
-            if str(discord_channel_id) in config.DISCORD_CHANNEL_LAST_USER:
-                discord_channel_last_user_id = config.DISCORD_CHANNEL_LAST_USER[str(discord_channel_id)]['user_id']
-                if discord_channel_last_user_id == str(config.DISCORD_BOT_ID):
-                    return True
-                else:
-                    return False
-            else:
-                if config.TELEGRAM_CHANNEL_LAST_USER[telegram_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                    # Check if the last message was sent less than 1 second ago
-                    return True
-                else:
-                    return False
-        else:
-            return False
-    else:
-        return False
+def get_route(message):
+    route = routes.get_route_by_telegram(message.chat.id)
+    if not route:
+        logging.warning("Discord channel not found for Telegram channel %s named %s", message.chat.id, message.chat.title)
+        return None
+
+    if not route.collection_name:
+        logging.warning("Collection not found for Telegram channel %s named %s", message.chat.id, message.chat.title)
+        return None
 
-def set_last_message_user_id(user_name:str, user_id:str, channel_id:str):
-    # Function to set the last message user ID in the config
-    config.TELEGRAM_CHANNEL_LAST_USER[channel_id] = {'user_id': user_id, 'timestamp': datetime.datetime.now(datetime.timezone.utc)}
+    return route
 
-def update_last_message_user_id():
-    # Function to update the last message user ID in the config
-    for channel_id in list(config.TELEGRAM_CHANNEL_LAST_USER.keys()):
-        if config.TELEGRAM_CHANNEL_LAST_USER[channel_id]['timestamp'] < (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)):
-            del config.TELEGRAM_CHANNEL_LAST_USER[channel_id]
+def get_user_name(message):
+    user = message.from_user
+    return f'{user.first_name} {user.last_name}' if user.last_name else user.first_name
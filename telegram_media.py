@@ -1,37 +1,24 @@
 import os
-import telebot
+import uuid
+import asyncio
+import aiohttp
+from telebot import asyncio_helper
 import hashlib
 import logging
-import subprocess
-import shutil
-import config
-# import lottie
-# # from lottie.parsers.tgs import parse_tgs
-# # from lottie.exporters.gif import export_gif
-# from PIL import Image
-# import io
-# from pyrlottie import LottieFile, convMultLottieTransparentFrames
-# import asyncio
+import media_cache
+import transcoder
+import stickers
 
 # --- Constants ---
 VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv', '.webm']
 MAX_VIDEO_SIZE_MB = 10
-TARGET_BITRATE = "1000k"
 DOWNLOAD_DIR = 'downloads'
 MAX_FILE_SIZE = 20 * 1024 * 1024
-
-# --- FFMPEG ---
-# Check if ffmpeg is available in the system PATH
-FFMPEG_PATH = shutil.which("ffmpeg")
-logging.debug("FFMPEG_PATH: %s", FFMPEG_PATH)
-
-# If not found, we can specify it manually (e.g. for Windows)
-if FFMPEG_PATH is None:
-    if os.name == 'nt':  # Windows
-        FFMPEG_PATH = config.FFMPEG_PATH
-    else:
-        logging.error("ffmpeg not found in PATH. Please install it or add it to the system PATH.")
-        raise FileNotFoundError("ffmpeg not found in PATH. Please install it or add it to the system PATH.")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 120  # seconds per file
+
+_http_session = None
+_inflight = {}  # file_unique_id -> download task
 
 # --- Utilities ---
 def ensure_directory_exists(path):
@@ -39,7 +26,7 @@ def ensure_directory_exists(path):
         os.makedirs(path)
 
 def generate_hashed_filename(content, original_ext):
-    file_hash = hashlib.sha256(content).hexdigest()
+    file_hash = media_cache.content_hash(content)
     return f"{file_hash}{original_ext}"
 
 def save_file(content, path):
@@ -52,146 +39,173 @@ def get_file_size_mb(path):
 def is_video_file(ext):
     return ext.lower() in VIDEO_EXTENSIONS
 
-def compress_video(input_path, output_path, target_bitrate=TARGET_BITRATE):
+def get_download_url(bot, file_path):
+    # Same URL scheme AsyncTeleBot.download_file uses, including custom Bot API servers
+    if asyncio_helper.FILE_URL is None:
+        return f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
+    return asyncio_helper.FILE_URL.format(bot.token, file_path)
+
+async def get_http_session():
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT))
+    return _http_session
+
+async def close_http_session():
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+async def stream_to_file(url, ext):
     """
-    Compresses a video file using ffmpeg to the specified bitrate.
+    Streams url into DOWNLOAD_DIR in DOWNLOAD_CHUNK_SIZE chunks, hashing as it goes,
+    and renames the spool file to <sha256><ext>. Peak memory is one chunk.
     """
-    logging.debug("Compressing video")
-
-    ffmpeg_cmd = [
-        FFMPEG_PATH,
-        "-i", input_path,
-        "-b:v", target_bitrate,
-        "-bufsize", target_bitrate,
-        "-y",  # overwrite if exists
-        output_path
-    ]
+    ensure_directory_exists(DOWNLOAD_DIR)
+    spool_path = os.path.join(DOWNLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+
+    session = await get_http_session()
     try:
-        subprocess.run(ffmpeg_cmd, check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error("Error compressing video", exc_info=True)
-        return False
-
-# def convert_tgs_to_gif(tgs_path, gif_path, frame_skip=0, scale=1):
-#     # Загружаем Lottie файл
-#     lottie_file = LottieFile(tgs_path)
-
-#     # Получаем кадры с прозрачностью (список PIL.Image)
-#     frames_dict = asyncio.run(convMultLottieTransparentFrames([lottie_file], frameSkip=frame_skip, scale=scale))
-#     frames = frames_dict[tgs_path].frames
-
-#     if not frames:
-#         raise Exception("No frames extracted from TGS file.")
-
-#     # Конвертируем в GIF
-#     frames[0].save(
-#         gif_path,
-#         save_all=True,
-#         append_images=frames[1:],
-#         duration=100,  # или вычисли на основе fps
-#         loop=0,
-#         transparency=0,
-#         disposal=2
-#     )
-
-def download_telegram_file(bot, file_id):
+        async with session.get(url) as response:
+            response.raise_for_status()
+            with open(spool_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_FILE_SIZE:
+                        raise ValueError(f"File size exceeds {MAX_FILE_SIZE // (1024 * 1024)} MB, skipping download.")
+                    hasher.update(chunk)
+                    f.write(chunk)
+    except BaseException:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        raise
+
+    file_name = f"{hasher.hexdigest()}{ext}"
+    local_path = os.path.join(DOWNLOAD_DIR, file_name)
+    os.replace(spool_path, local_path)
+    return local_path, file_name
+
+async def download_telegram_file(bot, file_id, file_unique_id=None, media_type=None):
     """
-    Downloads a file from Telegram using the provided bot and file_id.
-    Converts .tgs stickers to .gif, compresses video if needed.
+    Downloads a file from Telegram using the provided async bot and file_id.
+    The body is streamed straight to disk and videos go through the async
+    transcoding pool, so the shared event loop keeps serving Discord and Telegram.
+    Files seen before (same file_unique_id) come from the media cache instead,
+    already converted.
     """
+    if file_unique_id:
+        cached_path = media_cache.checkout_by_unique_id(file_unique_id, DOWNLOAD_DIR)
+        if cached_path:
+            logging.debug("Using cached media for %s", file_unique_id)
+            return cached_path
+
+        # The same file is already being fetched (e.g. a burst of one sticker): wait and reuse it
+        pending = _inflight.get(file_unique_id)
+        if pending is not None:
+            await asyncio.wait([pending])
+            cached_path = media_cache.checkout_by_unique_id(file_unique_id, DOWNLOAD_DIR)
+            if cached_path:
+                return cached_path
+
+    task = asyncio.ensure_future(_download_and_convert(bot, file_id, file_unique_id, media_type))
+    if file_unique_id:
+        _inflight[file_unique_id] = task
+        task.add_done_callback(lambda done: _forget_inflight(file_unique_id, done))
+    return await task
+
+def _forget_inflight(file_unique_id, task):
+    if _inflight.get(file_unique_id) is task:
+        del _inflight[file_unique_id]
+
+async def _download_and_convert(bot, file_id, file_unique_id, media_type):
     logging.debug("Downloading file from Telegram")
 
-    ensure_directory_exists(DOWNLOAD_DIR)
-
-    file_info = bot.get_file(file_id)
-    file_path = file_info.file_path
-    downloaded_file = bot.download_file(file_path)
-
-    ext = os.path.splitext(file_path)[-1]
-    file_name = generate_hashed_filename(downloaded_file, ext)
-    local_path = os.path.join(DOWNLOAD_DIR, file_name)
-
-    save_file(downloaded_file, local_path)
+    file_info = await bot.get_file(file_id)
+    file_path = file_info.file_path
+    ext = os.path.splitext(file_path)[-1]
+
+    local_path, file_name = await stream_to_file(get_download_url(bot, file_path), ext)
 
     # handle different file types
-    if ext.lower() == '.tgs':
-        return #handle_tgs_file(local_path, DOWNLOAD_DIR)
+    if media_type == 'sticker' and stickers.is_animated_sticker(ext):
+        result_path = await stickers.convert_sticker(local_path, DOWNLOAD_DIR)
+        os.remove(local_path)
+        if result_path is None:
+            return None
     elif is_video_file(ext):
-        return handle_video_file(local_path, file_name, DOWNLOAD_DIR)
+        result_path = await handle_video_file(local_path, file_name, DOWNLOAD_DIR)
     else:
-        return local_path
-
-# def handle_tgs_file(tgs_path, output_dir):
-#     """
-#     Converts a .tgs (Lottie) file to .gif and returns the gif path.
-#     """
-#     gif_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(tgs_path))[0]}.gif")
-#     try:
-#         convert_tgs_to_gif(tgs_path, gif_path)
-#         os.remove(tgs_path)
-#         logger(f"Converted .tgs to .gif: {gif_path}")
-#         return gif_path
-#     except Exception as e:
-#         logger(f"Failed to convert .tgs to .gif: {e}")
-#         return tgs_path
-
-def handle_video_file(video_path, file_name, output_dir):
+        result_path = local_path
+
+    # Only these kinds can be re-sent by file_id through send_photo/send_video/send_document
+    telegram_kind = media_type if media_type in ('photo', 'video', 'document') else None
+    media_cache.store_file(
+        result_path,
+        os.path.splitext(file_name)[0],
+        file_unique_id=file_unique_id,
+        telegram_file_id=file_id,
+        telegram_kind=telegram_kind,
+    )
+    return result_path
+
+async def handle_video_file(video_path, file_name, output_dir):
     """
-    Compresses a video file if it exceeds size limits.
-    Returns path to compressed or original video.
+    Remuxes or compresses a video so it fits MAX_VIDEO_SIZE_MB and plays inline.
+    Returns path to the converted or original video.
     """
-    if get_file_size_mb(video_path) > MAX_VIDEO_SIZE_MB:
-        logging.debug("Video detected: %s", file_name)
-        logging.debug("Compressing video %s as it exceeds %s MB", file_name, MAX_VIDEO_SIZE_MB)
-
-        compressed_path = os.path.join(output_dir, f"{os.path.splitext(file_name)[0]}_compressed.mp4")
-        if compress_video(video_path, compressed_path):
-            os.remove(video_path)
-            return compressed_path
-        else:
-            logging.warning("Compression failed for video %s, using original file", file_name)
-
-    return video_path
+    logging.debug("Video detected: %s", file_name)
+    try:
+        result_path = await transcoder.transcode_video(video_path, output_dir, MAX_VIDEO_SIZE_MB * 1024 * 1024)
+    except asyncio.CancelledError:
+        os.remove(video_path)
+        raise
+    except Exception:
+        logging.error("Error transcoding video %s, using original file", file_name, exc_info=True)
+        return video_path
+
+    if result_path != video_path:
+        os.remove(video_path)
+    return result_path
 
 def extract_media(message):
     """
-    Extracts media from a Telegram message and returns a list of tuples with file_id and type.
+    Extracts media from a Telegram message and returns a list of (file_id, type, file_unique_id) tuples.
     """
     logging.debug("Extracting media from message")
 
     media = []
     if message.photo:
         logging.debug("Photo detected in message")
-        media.append((message.photo[-1].file_id, 'photo'))  # max resolution
+        media.append((message.photo[-1].file_id, 'photo', message.photo[-1].file_unique_id))  # max resolution
     elif message.video:
         logging.debug("Video detected in message")
         if message.video.file_size > MAX_FILE_SIZE:
             raise ValueError(f"Video file size exceeds {MAX_FILE_SIZE // (1024 * 1024)} MB, skipping download.")
-        media.append((message.video.file_id, 'video'))
+        media.append((message.video.file_id, 'video', message.video.file_unique_id))
     elif message.document:
         logging.debug("Document detected in message")
         if message.document.file_size > MAX_FILE_SIZE:
             raise ValueError(f"Document file size exceeds {MAX_FILE_SIZE // (1024 * 1024)} MB, skipping download.")
-        media.append((message.document.file_id, 'document'))
+        media.append((message.document.file_id, 'document', message.document.file_unique_id))
     elif message.audio:
         logging.debug("Audio detected in message")
         if message.audio.file_size > MAX_FILE_SIZE:
             raise ValueError(f"Audio file size exceeds {MAX_FILE_SIZE // (1024 * 1024)} MB, skipping download.")
-        media.append((message.audio.file_id, 'audio'))
+        media.append((message.audio.file_id, 'audio', message.audio.file_unique_id))
     elif message.voice:
         logging.debug("Voice message detected in message")
-        media.append((message.voice.file_id, 'voice'))
+        media.append((message.voice.file_id, 'voice', message.voice.file_unique_id))
     elif message.sticker:
         logging.debug("Sticker detected in message")
-        media.append((message.sticker.file_id, 'sticker'))
+        media.append((message.sticker.file_id, 'sticker', message.sticker.file_unique_id))
     return media
 
-def get_media_files(message, tg_bot):
+async def get_media_files(message, tg_bot):
     media_info = extract_media(message)
     media_files = []
-    for file_id, _ in media_info:
-        media_files.append(download_telegram_file(tg_bot, file_id))
+    for file_id, media_type, file_unique_id in media_info:
+        media_files.append(await download_telegram_file(tg_bot, file_id, file_unique_id=file_unique_id, media_type=media_type))
 
     return media_files
 
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from telebot.asyncio_helper import ApiTelegramException
+import config
+
+# ------------------------
+# Rate-limited outbound Telegram queue
+# ------------------------
+# Every Discord->Telegram send goes through here. Each chat has a FIFO and a
+# token bucket (Telegram allows ~20 messages/min per group) and all chats share
+# a global bucket (~30 messages/s per bot). Sends go out as fast as both
+# buckets allow; a 429 from Telegram pauses the chat for retry_after seconds.
+# A media group costs one token per item, since Telegram counts each as a message.
+#
+# A caller can group its sends into a Delivery (track_delivery()) and later
+# withdraw() it: that only succeeds while none of its jobs has left the queue,
+# so a withdrawn message never reaches Telegram half sent.
+
+MAX_RETRIES = 3
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1):
+        # A cost above capacity goes out once the bucket is full and leaves it in
+        # debt, so the sends after it wait until the whole cost has refilled
+        loop = asyncio.get_running_loop()
+        needed = min(cost, self.capacity)
+        while True:
+            self._refill(loop.time())
+            if self.tokens >= needed:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((needed - self.tokens) / self.rate)
+
+class ChatQueue:
+    __slots__ = ('jobs', 'bucket', 'worker')
+
+    def __init__(self):
+        self.jobs = deque()
+        self.bucket = TokenBucket(config.TELEGRAM_CHAT_RATE_PER_MIN / 60, config.TELEGRAM_CHAT_BURST)
+        self.worker = None
+
+class Delivery:
+    __slots__ = ('queued', 'started')
+
+    def __init__(self):
+        self.queued = set()  # futures of jobs still waiting in a chat queue
+        self.started = False
+
+_current_delivery = contextvars.ContextVar('telegram_delivery', default=None)
+
+_chats = {}
+_global_bucket = None
+stats = {'sent': 0, 'failed': 0, 'retries': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+def _get_global_bucket():
+    global _global_bucket
+    if _global_bucket is None:
+        _global_bucket = TokenBucket(config.TELEGRAM_GLOBAL_RATE_PER_SEC, config.TELEGRAM_GLOBAL_RATE_PER_SEC)
+    return _global_bucket
+
+def _rewind_files(kwargs):
+    # Uploads are BytesIO-backed and were consumed by the failed attempt
+    for value in kwargs.values():
+        for item in (value if isinstance(value, list) else [value]):
+            file = getattr(item, 'media', item)
+            file = getattr(file, 'file', file)
+            if hasattr(file, 'seek'):
+                file.seek(0)
+
+async def _call_with_retry(func, kwargs):
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            _rewind_files(kwargs)
+        try:
+            return await func(**kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 429 or attempt == MAX_RETRIES:
+                raise
+            retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+            stats['retries'] += 1
+            logging.warning("Telegram rate limit hit for chat %s, retrying in %ss", kwargs.get('chat_id'), retry_after)
+            await asyncio.sleep(retry_after)
+
+async def _run_chat(chat):
+    loop = asyncio.get_running_loop()
+    future = None
+    try:
+        while chat.jobs:
+            future, func, kwargs, cost, enqueued, delivery = chat.jobs.popleft()
+            if future.cancelled():
+                continue
+            if delivery is not None:
+                delivery.started = True
+                delivery.queued.discard(future)
+            await chat.bucket.acquire(cost)
+            await _get_global_bucket().acquire(cost)
+
+            waited = loop.time() - enqueued
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            try:
+                result = await _call_with_retry(func, kwargs)
+            except Exception as e:
+                stats['failed'] += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                stats['sent'] += 1
+                if not future.cancelled():
+                    future.set_result(result)
+    finally:
+        # Shutdown cancels the worker: don't leave the current caller hanging
+        if future is not None and not future.done():
+            future.cancel()
+        chat.worker = None
+
+def submit(func, **kwargs):
+    """
+    Queues func(**kwargs) (an AsyncTeleBot send method) for its chat_id and
+    returns a future resolving to the API result. A media group (a media list)
+    is rate limited as one message per item.
+    """
+    loop = asyncio.get_running_loop()
+    chat_id = str(kwargs['chat_id'])
+    chat = _chats.get(chat_id)
+    if chat is None:
+        chat = _chats[chat_id] = ChatQueue()
+
+    future = loop.create_future()
+    delivery = _current_delivery.get()
+    if delivery is not None:
+        delivery.queued.add(future)
+        future.add_done_callback(delivery.queued.discard)
+    media = kwargs.get('media')
+    cost = len(media) if isinstance(media, list) and media else 1
+    chat.jobs.append((future, func, kwargs, cost, loop.time(), delivery))
+    if chat.worker is None:
+        chat.worker = loop.create_task(_run_chat(chat))
+    return future
+
+async def send(func, **kwargs):
+    return await submit(func, **kwargs)
+
+def track_delivery():
+    """
+    Starts a Delivery for the current task: every send it (and tasks it
+    starts) makes from now on belongs to it.
+    """
+    delivery = Delivery()
+    _current_delivery.set(delivery)
+    return delivery
+
+def withdraw(delivery):
+    """
+    Cancels the delivery's queued jobs if none of its jobs has been handed to
+    Telegram yet. Returns False, leaving everything queued, once one has.
+    """
+    if delivery.started:
+        return False
+    for future in list(delivery.queued):
+        future.cancel()
+    return True
+
+def get_stats():
+    done = stats['sent'] + stats['failed']
+    return {
+        'queue_depth': sum(len(chat.jobs) for chat in _chats.values()),
+        'queue_depth_by_chat': {chat_id: len(chat.jobs) for chat_id, chat in _chats.items() if chat.jobs},
+        'sent': stats['sent'],
+        'failed': stats['failed'],
+        'retries': stats['retries'],
+        'wait_avg': stats['wait_total'] / done if done else 0.0,
+        'wait_max': stats['wait_max'],
+    }
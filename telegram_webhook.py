@@ -0,0 +1,87 @@
+import hmac
+import asyncio
+import secrets
+import logging
+from aiohttp import web
+from telebot import types
+import config
+
+# ------------------------
+# Webhook ingest for Telegram updates
+# ------------------------
+# A small aiohttp server that Telegram (or a reverse proxy in front of it)
+# POSTs updates to. Requests must carry the secret token registered with
+# set_webhook; valid updates are handed to the same handlers polling uses.
+# Without TELEGRAM_WEBHOOK_SECRET a random token is generated per start, so the
+# endpoint is never left open.
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def create_app(bot, secret_token, path):
+    # Kept separate from start_webhook() so the server can be exercised without
+    # registering anything with Telegram
+    if not secret_token:
+        raise ValueError("A secret token is required for the Telegram webhook")
+    pending = set()
+
+    async def handle_update(request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+            logging.warning("Rejected Telegram webhook request with bad secret token from %s", request.remote)
+            return web.Response(status=401)
+
+        try:
+            update = types.Update.de_json(await request.text())
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning("Malformed Telegram webhook update: %s", e)
+            return web.Response(status=400)
+
+        # Answer right away; Telegram retries slow responses
+        task = asyncio.create_task(bot.process_new_updates([update]))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        return web.Response(status=200)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+async def start_webhook(bot):
+    """
+    Registers the webhook with Telegram and starts the local HTTP server.
+    Returns the aiohttp runner; call stop_webhook() with it on shutdown.
+    """
+    if not config.TELEGRAM_WEBHOOK_URL:
+        raise ValueError("TELEGRAM_WEBHOOK_URL must be set for webhook mode")
+
+    secret_token = config.TELEGRAM_WEBHOOK_SECRET
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logging.info("TELEGRAM_WEBHOOK_SECRET is not set, using a generated secret token")
+
+    app = create_app(bot, secret_token, config.TELEGRAM_WEBHOOK_PATH)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.TELEGRAM_WEBHOOK_HOST, config.TELEGRAM_WEBHOOK_PORT)
+    await site.start()
+
+    try:
+        await bot.set_webhook(
+            url=config.TELEGRAM_WEBHOOK_URL,
+            secret_token=secret_token,
+        )
+    except Exception:
+        await runner.cleanup()
+        raise
+
+    logging.info(
+        "Telegram webhook listening on %s:%s%s for %s",
+        config.TELEGRAM_WEBHOOK_HOST, config.TELEGRAM_WEBHOOK_PORT, config.TELEGRAM_WEBHOOK_PATH, config.TELEGRAM_WEBHOOK_URL,
+    )
+    return runner
+
+async def stop_webhook(bot, runner):
+    try:
+        await bot.delete_webhook()
+    except Exception:
+        logging.warning("Failed to delete Telegram webhook", exc_info=True)
+    await runner.cleanup()
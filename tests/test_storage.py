@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+# A coalesced burst: three Discord messages bridged as one Telegram message
+BURST = [(1, 101, 'text', 'discord'), (1, 102, 'text', 'discord'), (1, 103, 'text', 'discord')]
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        backend = storage.SQLiteStorage(str(tmp_path / 'mappings.db'))
+    else:
+        backend = storage.MemoryStorage()
+    yield backend
+    backend.close()
+
+
+def test_burst_keeps_every_row(backend):
+    backend.save_messages(BURST, 'chat')
+    # A replayed batch must not add or drop rows
+    backend.save_messages(BURST, 'chat')
+
+    for telegram_message_id, discord_message_id, _, _ in BURST:
+        assert backend.get_telegram_message_id(discord_message_id, 'chat', source='discord') == telegram_message_id
+    # The Telegram side resolves to the first line of the burst
+    assert backend.get_discord_message_id(1, 'chat') == 101
+
+
+def test_sqlite_burst_persists_three_rows(tmp_path):
+    path = str(tmp_path / 'mappings.db')
+    backend = storage.SQLiteStorage(path)
+    backend.save_messages(BURST, 'chat')
+    backend.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE collection = 'chat'").fetchone()[0] == 3
+    conn.close()
+
+
+def test_sqlite_migrates_unique_telegram_index(tmp_path):
+    # Databases created before bursts were mapped had a unique index on the Telegram ID
+    path = str(tmp_path / 'mappings.db')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE messages (collection TEXT NOT NULL, telegram_message_id INTEGER NOT NULL, "
+        "discord_message_id INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE UNIQUE INDEX messages_telegram ON messages (collection, telegram_message_id)")
+    conn.execute("INSERT INTO messages VALUES ('chat', 5, 500)")
+    conn.commit()
+    conn.close()
+
+    backend = storage.SQLiteStorage(path)
+    backend.save_messages(BURST, 'chat')
+    assert backend.get_telegram_message_id(500, 'chat') == 5
+    assert [backend.get_telegram_message_id(d, 'chat') for _, d, _, _ in BURST] == [1, 1, 1]
+    backend.close()
+
+
+def test_source_filter(backend):
+    backend.save_messages(BURST, 'chat')
+    backend.save_messages([(2, 104, 'text', 'telegram')], 'chat')
+
+    assert backend.get_telegram_message_id(101, 'chat', source='telegram') is None
+    assert backend.get_telegram_message_id(104, 'chat', source='discord') is None
+    assert backend.get_telegram_message_id(104, 'chat') == 2
+
+
+def test_all_telegram_ids_of_an_album(backend):
+    # One Discord message with three attachments, one Telegram message each
+    album = [(11, 200, 'attachment', 'discord'), (12, 200, 'attachment', 'discord'), (13, 200, 'attachment', 'discord')]
+    backend.save_messages(album, 'chat')
+
+    assert backend.get_telegram_message_ids(200, 'chat', source='discord') == [11, 12, 13]
+    assert backend.get_telegram_message_ids(200, 'chat', source='telegram') == []
+    assert backend.get_telegram_message_id(200, 'chat') == 11
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import telegram_webhook
+
+SECRET = 'test-secret'
+PATH = '/telegram'
+UPDATE = {
+    "update_id": 7,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": -100, "type": "supergroup", "title": "Test"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+        "text": "hello",
+    },
+}
+
+
+class FakeBot:
+    def __init__(self):
+        self.updates = []
+
+    async def process_new_updates(self, updates):
+        self.updates.extend(updates)
+
+
+async def post(bot, headers, body=UPDATE):
+    app = telegram_webhook.create_app(bot, SECRET, PATH)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(PATH, json=body, headers=headers)
+        # Let the handler's background task hand the update over
+        await asyncio.sleep(0)
+        return response.status
+
+
+def test_bad_secret_is_rejected():
+    bot = FakeBot()
+    assert asyncio.run(post(bot, {telegram_webhook.SECRET_HEADER: 'wrong'})) == 401
+    assert asyncio.run(post(bot, {})) == 401
+    assert bot.updates == []
+
+
+def test_valid_update_is_processed():
+    bot = FakeBot()
+    assert asyncio.run(post(bot, {telegram_webhook.SECRET_HEADER: SECRET})) == 200
+    assert [update.update_id for update in bot.updates] == [7]
+    assert bot.updates[0].message.text == "hello"
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        telegram_webhook.create_app(FakeBot(), '', PATH)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ------------------------
+# Async ffmpeg transcoding pool
+# ------------------------
+# Videos are probed with ffprobe and then, cheapest first:
+#   - passed through untouched when they already fit the size limit
+#   - remuxed (stream copy) into mp4 when the codecs already play in Discord
+#     but the container doesn't, or when only the audio/extra streams are too big
+#   - re-encoded at a bitrate computed from the duration to land under the limit
+# At most TRANSCODE_WORKERS ffmpeg processes run at once and at most
+# TRANSCODE_MAX_QUEUE jobs wait for a slot; anything beyond that is sent as is.
+# Every job has a TRANSCODE_TIMEOUT and is killed if its caller is cancelled.
+
+# Codecs Discord and Telegram clients play inline from an mp4
+COPYABLE_VIDEO_CODECS = {'h264'}
+COPYABLE_AUDIO_CODECS = {'aac', 'mp3'}
+MP4_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+
+AUDIO_BITRATE = 96_000
+MIN_VIDEO_BITRATE = 150_000
+# Leave room for container overhead and encoder overshoot
+SIZE_SAFETY_MARGIN = 0.92
+# Used when the duration can't be probed
+FALLBACK_BITRATE = "1000k"
+
+# --- FFMPEG ---
+# Check if ffmpeg is available in the system PATH
+FFMPEG_PATH = shutil.which("ffmpeg")
+logging.debug("FFMPEG_PATH: %s", FFMPEG_PATH)
+
+# If not found, we can specify it manually (e.g. for Windows)
+if FFMPEG_PATH is None:
+    if os.name == 'nt':  # Windows
+        FFMPEG_PATH = config.FFMPEG_PATH
+    else:
+        logging.error("ffmpeg not found in PATH. Please install it or add it to the system PATH.")
+        raise FileNotFoundError("ffmpeg not found in PATH. Please install it or add it to the system PATH.")
+
+# ffprobe ships next to ffmpeg
+FFPROBE_PATH = shutil.which("ffprobe")
+if FFPROBE_PATH is None and FFMPEG_PATH:
+    ffmpeg_dir, ffmpeg_name = os.path.split(FFMPEG_PATH)
+    FFPROBE_PATH = os.path.join(ffmpeg_dir, ffmpeg_name.replace("ffmpeg", "ffprobe"))
+
+_slots = None
+_running = set()
+stats = {
+    'queued': 0, 'running': 0, 'rejected': 0,
+    'passthrough': 0, 'remuxed': 0, 'encoded': 0, 'failed': 0, 'timeouts': 0,
+    'queue_wait_total': 0.0, 'queue_wait_max': 0.0,
+    'encode_time_total': 0.0, 'encode_time_max': 0.0,
+}
+
+def _get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(config.TRANSCODE_WORKERS)
+    return _slots
+
+# ------------------------
+# Subprocess helpers
+# ------------------------
+
+def limit_cpu_time(pid, cpu_seconds):
+    # Caps the CPU seconds a just-started process may use (Linux prlimit);
+    # the kernel sends SIGXCPU, then SIGKILL, once the budget is spent.
+    # Set from the parent after spawning: preexec_fn isn't safe with threads around.
+    if not hasattr(resource, 'prlimit') or not cpu_seconds:
+        return
+    try:
+        _, hard = resource.prlimit(pid, resource.RLIMIT_CPU)
+        soft = int(cpu_seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, hard))
+    except (OSError, ValueError) as e:
+        # Already exited, or the limit can't be lowered; the timeout still applies
+        logging.debug("Could not set CPU limit for process %s: %s", pid, e)
+
+async def run_process(args, timeout, cpu_seconds=None):
+    """
+    Runs args as an async subprocess and returns (returncode, stdout, stderr).
+    The process is killed on timeout (asyncio.TimeoutError) or cancellation,
+    and by the kernel once it used cpu_seconds of CPU time if given.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    limit_cpu_time(process.pid, cpu_seconds)
+    _running.add(process)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        return process.returncode, stdout, stderr
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    finally:
+        _running.discard(process)
+
+async def probe(path):
+    # Returns ffprobe's format/streams JSON, or None if it can't be read
+    args = [FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    try:
+        returncode, stdout, stderr = await run_process(args, config.TRANSCODE_PROBE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError) as e:
+        logging.warning("ffprobe failed for %s: %s", path, e)
+        return None
+    if returncode != 0:
+        logging.warning("ffprobe failed for %s: %s", path, stderr.decode(errors='replace').strip())
+        return None
+    return json.loads(stdout)
+
+# ------------------------
+# Planning
+# ------------------------
+
+def _first_stream(info, codec_type):
+    return next((s for s in info.get('streams', []) if s.get('codec_type') == codec_type), None)
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def plan_transcode(info, path, size, target_bytes):
+    """
+    Picks the cheapest way to make path fit target_bytes and play inline.
+    Returns (action, ffmpeg output args) where action is "passthrough", "remux" or "encode".
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if info is None:
+        if size <= target_bytes:
+            return 'passthrough', None
+        return 'encode', ["-c:v", "libx264", "-preset", "veryfast", "-b:v", FALLBACK_BITRATE, "-bufsize", FALLBACK_BITRATE, "-c:a", "aac"]
+
+    video = _first_stream(info, 'video')
+    audio = _first_stream(info, 'audio')
+    video_fits = video is not None and video.get('codec_name') in COPYABLE_VIDEO_CODECS
+    audio_fits = audio is None or audio.get('codec_name') in COPYABLE_AUDIO_CODECS
+    faststart = ["-movflags", "+faststart"]
+
+    if size <= target_bytes:
+        # Already small enough; only rewrap h264 out of containers Discord won't embed
+        if ext not in MP4_EXTENSIONS and video_fits and audio_fits:
+            return 'remux', ["-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"] + faststart
+        return 'passthrough', None
+
+    duration = _int(info.get('format', {}).get('duration'))
+    if not duration:
+        return 'encode', ["-c:v", "libx264", "-preset", "veryfast", "-b:v", FALLBACK_BITRATE, "-bufsize", FALLBACK_BITRATE, "-c:a", "aac"] + faststart
+
+    audio_bitrate = AUDIO_BITRATE if audio is not None else 0
+    video_budget = int(target_bytes * 8 * SIZE_SAFETY_MARGIN / duration) - audio_bitrate
+
+    # The video stream alone already fits: the bulk is audio or extra streams, so copy the video
+    video_bitrate = _int(video.get('bit_rate')) if video else None
+    if video_fits and video_bitrate and video_bitrate <= video_budget:
+        return 'remux', ["-map", "0:v:0", "-map", "0:a:0?", "-c:v", "copy", "-c:a", "aac", "-b:a", str(AUDIO_BITRATE)] + faststart
+
+    video_budget = max(video_budget, MIN_VIDEO_BITRATE)
+    return 'encode', [
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", "veryfast",
+        "-b:v", str(video_budget), "-maxrate", str(video_budget), "-bufsize", str(video_budget * 2),
+        "-c:a", "aac", "-b:a", str(AUDIO_BITRATE),
+    ] + faststart
+
+# ------------------------
+# Public API
+# ------------------------
+
+async def transcode_video(input_path, output_dir, target_bytes):
+    """
+    Makes a video fit target_bytes, returning the path to send: a new file in
+    output_dir, or input_path when no work was needed or the job failed.
+    The caller removes input_path if a new file was returned.
+    """
+    if stats['queued'] >= config.TRANSCODE_MAX_QUEUE:
+        stats['rejected'] += 1
+        logging.warning("Transcode queue full, sending %s as is", input_path)
+        return input_path
+
+    loop = asyncio.get_running_loop()
+    enqueued = loop.time()
+    stats['queued'] += 1
+    try:
+        await _get_slots().acquire()
+    finally:
+        stats['queued'] -= 1
+
+    stats['running'] += 1
+    waited = loop.time() - enqueued
+    stats['queue_wait_total'] += waited
+    stats['queue_wait_max'] = max(stats['queue_wait_max'], waited)
+    try:
+        return await _transcode(input_path, output_dir, target_bytes)
+    finally:
+        stats['running'] -= 1
+        _get_slots().release()
+
+async def _transcode(input_path, output_dir, target_bytes):
+    size = os.path.getsize(input_path)
+    info = await probe(input_path)
+    action, output_args = plan_transcode(info, input_path, size, target_bytes)
+    if action == 'passthrough':
+        stats['passthrough'] += 1
+        return input_path
+
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    suffix = "_remux" if action == 'remux' else "_compressed"
+    output_path = os.path.join(output_dir, f"{base}{suffix}.mp4")
+    args = [FFMPEG_PATH, "-hide_banner", "-nostdin", "-y", "-i", input_path] + output_args + [output_path]
+
+    logging.debug("Transcoding %s (%s bytes) with %s", input_path, size, action)
+    started = time.monotonic()
+    try:
+        returncode, _, stderr = await run_process(args, config.TRANSCODE_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats['timeouts'] += 1
+        logging.warning("Transcoding %s timed out after %ss, sending original", input_path, config.TRANSCODE_TIMEOUT)
+        _remove_quietly(output_path)
+        return input_path
+    except BaseException:
+        _remove_quietly(output_path)
+        raise
+
+    elapsed = time.monotonic() - started
+    stats['encode_time_total'] += elapsed
+    stats['encode_time_max'] = max(stats['encode_time_max'], elapsed)
+
+    if returncode != 0:
+        stats['failed'] += 1
+        logging.error("Error transcoding video %s: %s", input_path, stderr.decode(errors='replace').strip()[-500:])
+        _remove_quietly(output_path)
+        return input_path
+
+    stats['remuxed' if action == 'remux' else 'encoded'] += 1
+    logging.debug("Transcoded %s in %.1fs: %s -> %s bytes", input_path, elapsed, size, os.path.getsize(output_path))
+    return output_path
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def shutdown():
+    # Kill ffmpeg processes still running so they don't outlive the bot
+    for process in list(_running):
+        if process.returncode is None:
+            process.kill()
+    for process in list(_running):
+        await process.wait()
+
+def get_stats():
+    done = stats['remuxed'] + stats['encoded'] + stats['failed']
+    jobs = done + stats['passthrough'] + stats['timeouts']
+    return {
+        **{key: value for key, value in stats.items() if not key.endswith(('_total', '_max'))},
+        'queue_wait_avg': stats['queue_wait_total'] / jobs if jobs else 0.0,
+        'queue_wait_max': stats['queue_wait_max'],
+        'encode_time_avg': stats['encode_time_total'] / done if done else 0.0,
+        'encode_time_max': stats['encode_time_max'],
+    }